@@ -1,7 +1,12 @@
 import streamlit as st
 import requests
 import json
+import time
+import uuid
 from pathlib import Path
+from typing import Any, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 
 # Configure logging
@@ -10,6 +15,15 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 API_BASE_URL = "http://localhost:8000"
+# (connect, read) timeouts in seconds
+CONNECT_TIMEOUT = 3.05
+QUERY_TIMEOUT = (CONNECT_TIMEOUT, 120)
+UPLOAD_TIMEOUT = (CONNECT_TIMEOUT, 60)
+SHORT_TIMEOUT = (CONNECT_TIMEOUT, 10)
+STATS_TTL_SECONDS = 10
+HISTORY_PAGE_SIZE = 20
+UPLOAD_POLL_SECONDS = 0.5
+UPLOAD_MAX_WAIT_SECONDS = 600
 
 st.set_page_config(
     page_title="Document QA Chatbot",
@@ -17,9 +31,139 @@ st.set_page_config(
     layout="wide"
 )
 
+class ApiClient:
+    """Thin client for the backend API over one pooled keep-alive session.
+    
+    Connection errors and 429/502/503/504 responses are retried with
+    exponential backoff, honouring the server's Retry-After header. Read
+    timeouts are not retried, so a slow query is never answered twice.
+    """
+
+    def __init__(self, base_url: str = API_BASE_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=0,
+            status=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST", "DELETE"}),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method: str, path: str, timeout, **kwargs) -> requests.Response:
+        return self.session.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs)
+
+    def query(self, question: str, session_id: Optional[str] = None) -> requests.Response:
+        return self._request("POST", "/query", QUERY_TIMEOUT,
+                             json={"question": question, "session_id": session_id})
+
+    def start_upload(self, name: str, data: bytes, content_type: Optional[str]) -> requests.Response:
+        # Bytes rather than a file object, so a retried request resends the whole body
+        return self._request("POST", "/upload", UPLOAD_TIMEOUT,
+                             files={"file": (name, data, content_type)}, params={"wait": "false"})
+
+    def upload_status(self, job_id: str) -> Dict[str, Any]:
+        response = self._request("GET", f"/upload/jobs/{job_id}", SHORT_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self) -> Dict[str, Any]:
+        response = self._request("GET", "/stats", SHORT_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def end_session(self, session_id: str):
+        self._request("DELETE", f"/sessions/{session_id}", SHORT_TIMEOUT)
+
+@st.cache_resource
+def get_client() -> ApiClient:
+    """One client (and connection pool) shared by all reruns and browser sessions."""
+    return ApiClient()
+
+@st.cache_data(ttl=STATS_TTL_SECONDS, show_spinner=False)
+def fetch_stats() -> Dict[str, Any]:
+    return get_client().stats()
+
+def show_upload_result(result: Dict[str, Any]):
+    st.success(f"✅ {result.get('message', 'Document uploaded')}")
+    if "chunks_added" in result:
+        st.info(f"Added {result['chunks_added']} text chunks")
+    fetch_stats.clear()
+
+def upload_with_progress(uploaded_file):
+    """Upload a file and follow its server-side ingestion progress for up to UPLOAD_MAX_WAIT_SECONDS."""
+    client = get_client()
+    response = client.start_upload(uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)
+    if response.status_code not in (200, 202):
+        st.error(f"❌ Upload failed: {response.text}")
+        return
+    
+    body = response.json()
+    if response.status_code == 200:
+        # The server ingested the file before answering: the body is the finished result
+        show_upload_result(body)
+        return
+    job_id = body.get("job_id")
+    if not job_id:
+        st.error(f"❌ Upload failed: the server returned no job id ({body})")
+        return
+    
+    job = body
+    bar = st.progress(0.0, text="Uploaded, waiting for ingestion...")
+    give_up_at = time.monotonic() + UPLOAD_MAX_WAIT_SECONDS
+    while job.get("state") not in ("done", "failed"):
+        if time.monotonic() > give_up_at:
+            st.error(f"❌ Ingestion of {uploaded_file.name} did not finish within {UPLOAD_MAX_WAIT_SECONDS}s. "
+                     "It may still complete; check the statistics later.")
+            return
+        time.sleep(UPLOAD_POLL_SECONDS)
+        try:
+            job = client.upload_status(job_id)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                st.error("❌ The server no longer knows this upload job (it may have restarted). Please upload again.")
+                return
+            raise
+        progress = min(1.0, float(job.get("progress", 0.0)))
+        bar.progress(progress, text=f"{str(job.get('stage', 'processing')).capitalize()}... {progress:.0%}")
+    
+    if job["state"] == "done":
+        bar.progress(1.0, text="Done")
+        show_upload_result(job.get("result") or {})
+    else:
+        st.error(f"❌ Upload failed: {job.get('error', 'unknown error')}")
+
+def render_message(index: int, message: Dict[str, Any]):
+    with st.chat_message(message["role"]):
+        st.markdown(message["content"])
+        
+        # Metadata is only serialized when the user asks for it
+        if message["role"] == "assistant" and message.get("metadata"):
+            if st.toggle("🔍 Query Details", key=f"details_{index}"):
+                st.json(message["metadata"])
+
+def render_history():
+    """Render the most recent page of the conversation; older messages load on demand."""
+    messages = st.session_state.messages
+    start = max(0, len(messages) - st.session_state.history_window)
+    if start > 0:
+        if st.button(f"⬆️ Show {min(HISTORY_PAGE_SIZE, start)} earlier messages ({start} hidden)"):
+            st.session_state.history_window += HISTORY_PAGE_SIZE
+            st.rerun()
+    for index in range(start, len(messages)):
+        render_message(index, messages[index])
+
 def main():
     st.title("📚 DocMate")
     st.markdown("Upload relevant documents and ask questions!")
+    client = get_client()
     
     # Sidebar for document management
     with st.sidebar:
@@ -34,32 +178,20 @@ def main():
         
         if uploaded_file is not None:
             if st.button("Upload Document"):
-                with st.spinner("Uploading and processing document..."):
-                    try:
-                        files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-                        response = requests.post(f"{API_BASE_URL}/upload", files=files)
-                        
-                        if response.status_code == 200:
-                            result = response.json()
-                            st.success(f"✅ {result['message']}")
-                            st.info(f"Added {result['chunks_added']} text chunks")
-                        else:
-                            st.error(f"❌ Upload failed: {response.text}")
-                    except Exception as e:
-                        st.error(f"❌ Error: {str(e)}")
+                try:
+                    upload_with_progress(uploaded_file)
+                except Exception as e:
+                    st.error(f"❌ Error: {str(e)}")
         
         # Stats section
         st.header("📊 Statistics")
+        # Served from a short-lived cache on reruns; the button forces a fresh request
         if st.button("Refresh Stats"):
-            try:
-                response = requests.get(f"{API_BASE_URL}/stats")
-                if response.status_code == 200:
-                    stats = response.json()
-                    st.json(stats)
-                else:
-                    st.error("Failed to get stats")
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+            fetch_stats.clear()
+        try:
+            st.json(fetch_stats(), expanded=False)
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
     
     # Main chat interface
     st.header("💬 Chat Interface")
@@ -67,16 +199,14 @@ def main():
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "history_window" not in st.session_state:
+        st.session_state.history_window = HISTORY_PAGE_SIZE
+    # The server keeps the conversation under this id, so follow-ups reuse its evidence
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
     
     # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            
-            # Show metadata for assistant messages
-            if message["role"] == "assistant" and "metadata" in message:
-                with st.expander("🔍 Query Details"):
-                    st.json(message["metadata"])
+    render_history()
     
     # Chat input
     if prompt := st.chat_input("Ask a question about your documents..."):
@@ -92,10 +222,7 @@ def main():
             with st.spinner("Thinking... 🤔"):
                 try:
                     # Make API request
-                    response = requests.post(
-                        f"{API_BASE_URL}/query",
-                        json={"question": prompt}
-                    )
+                    response = client.query(prompt, st.session_state.session_id)
                     
                     if response.status_code == 200:
                         result = response.json()
@@ -114,7 +241,7 @@ def main():
                         
                         # Show metadata
                         if metadata:
-                            with st.expander("🔍 Query Details"):
+                            if st.toggle("🔍 Query Details", key=f"details_{len(st.session_state.messages) - 1}"):
                                 st.json(metadata)
                     
                     else:
@@ -135,7 +262,13 @@ def main():
     
     # Clear chat button
     if st.button("🗑️ Clear Chat"):
+        try:
+            client.end_session(st.session_state.session_id)
+        except Exception as e:
+            logger.warning(f"Could not end server session: {e}")
         st.session_state.messages = []
+        st.session_state.history_window = HISTORY_PAGE_SIZE
+        st.session_state.session_id = uuid.uuid4().hex
         st.rerun()
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+"""Recall@k and memory of the compressed vector index versus exact float32 search.
+
+By default uses synthetic clustered 384-dimensional vectors (the MiniLM size);
+pass --from-store to use the embeddings already in the store (the Chroma
+collection, or the compressed index's full-precision file in compressed mode).
+
+Usage:
+    python -m benchmarks.benchmark_compression --vectors 100000 --k 10
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+from config.settings import settings
+from src.chatbot.compressed_index import CompressedVectorIndex
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 100), dim))
+    vectors = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def store_vectors() -> np.ndarray:
+    if settings.vector_compression != "none":
+        # Compressed mode keeps no vectors in Chroma
+        index = CompressedVectorIndex(str(Path(settings.chroma_db_path) / f"compressed_{settings.vector_compression}"),
+                                      mode=settings.vector_compression)
+        return np.delete(np.asarray(index._full), sorted(index.deleted), axis=0)
+    import chromadb
+    client = chromadb.PersistentClient(path=settings.chroma_db_path)
+    collection = client.get_collection("langchain")
+    return np.asarray(collection.get(include=["embeddings"])["embeddings"], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--memory-budget-mb", type=int, default=settings.compressed_memory_budget_mb)
+    parser.add_argument("--from-store", action="store_true")
+    args = parser.parse_args()
+
+    vectors = store_vectors() if args.from_store else synthetic_vectors(args.vectors, 384)
+    queries = vectors[np.random.default_rng(1).choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = queries + 0.05 * np.random.default_rng(2).normal(size=queries.shape).astype(np.float32)
+    ids = [str(i) for i in range(len(vectors))]
+    exact = [set(np.argsort(-(vectors @ q))[:args.k].astype(str)) for q in queries]
+
+    print(f"{len(vectors)} vectors, float32 size {vectors.nbytes / 1e6:.1f} MB, k={args.k}")
+    print(f"{'mode':<10}{'rescore':>8}{'recall@k':>10}{'resident MB':>13}{'ms/query':>10}")
+    for mode in ("float16", "int8"):
+        for rescore_factor in (1, 4):
+            with tempfile.TemporaryDirectory() as path:
+                index = CompressedVectorIndex(path, mode=mode, memory_budget_mb=args.memory_budget_mb,
+                                              rescore_factor=rescore_factor)
+                index.add(ids, vectors)
+                start = time.perf_counter()
+                results = [index.search(q, k=args.k) for q in queries]
+                elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+                recall = np.mean([
+                    len({id_ for id_, _ in hits} & truth) / args.k
+                    for hits, truth in zip(results, exact)
+                ])
+                resident_mb = index.memory_usage()["resident_bytes"] / 1e6
+                print(f"{mode:<10}{rescore_factor:>8}{recall:>10.4f}{resident_mb:>13.1f}{elapsed_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Prompt tokens per answer: raw top-k chunks vs assembled context.
+
+Runs sample questions against the existing index and compares the tokens
+of the raw concatenated candidates with the MMR-selected, merged and
+sentence-compressed context built for the same candidates.
+
+Usage:
+    python -m benchmarks.benchmark_context --questions "What is the refund policy?" "Who signed the contract?"
+"""
+import argparse
+import time
+
+from config.settings import settings
+from src.chatbot.context import ContextAssembler
+from src.chatbot.vector_store import VectorStore
+
+DEFAULT_QUESTIONS = [
+    "What is this document about?",
+    "Summarize the main findings.",
+    "What are the key dates mentioned?",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", nargs="+", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--candidates", type=int, default=settings.context_candidates)
+    parser.add_argument("--budget", type=int, default=settings.context_token_budget)
+    args = parser.parse_args()
+
+    store = VectorStore()
+    assembler = ContextAssembler(store.embeddings, token_budget=args.budget, mmr_lambda=settings.mmr_lambda,
+                                 max_passages=settings.context_max_passages)
+
+    print(f"{'raw top-3':>10}{'raw top-k':>10}{'assembled':>10}{'saved':>8}{'ms':>8}  question")
+    totals = [0, 0]
+    for question in args.questions:
+        results = store.search(question, k=args.candidates)
+        top3 = assembler.count_tokens("\n".join(result.content for result in results[:3]))
+        start = time.perf_counter()
+        _, stats = assembler.assemble(question, results)
+        elapsed = (time.perf_counter() - start) * 1000
+        totals[0] += stats["tokens_before"]
+        totals[1] += stats["tokens_after"]
+        print(f"{top3:>10}{stats['tokens_before']:>10}{stats['tokens_after']:>10}{stats['tokens_saved']:>8}"
+              f"{elapsed:>8.1f}  {question}")
+
+    if totals[0]:
+        print(f"\nAssembled context uses {totals[1] / totals[0]:.0%} of the raw candidate tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare embedding backends: PyTorch fp32 vs ONNX fp32 vs ONNX int8.
+
+Reports throughput (texts/second) and how closely each backend's vectors
+match the PyTorch reference (cosine similarity and top-k retrieval overlap).
+
+Usage:
+    python -m src.chatbot.embeddings --quantize   # export the ONNX models once
+    python -m benchmarks.benchmark_embeddings --texts 2000
+"""
+import argparse
+import time
+from typing import List
+import numpy as np
+
+from config.settings import settings
+from src.chatbot.document_processor import DocumentProcessor
+from src.chatbot.embeddings import OnnxEmbeddings
+
+
+def load_corpus(limit: int) -> List[str]:
+    """Use chunks from the upload directory, padded with synthetic text if needed."""
+    texts = [doc.page_content for doc in DocumentProcessor().process_directory(settings.upload_dir)]
+    i = 0
+    while len(texts) < limit:
+        texts.append(f"Synthetic benchmark sentence number {i} about document question answering.")
+        i += 1
+    return texts[:limit]
+
+
+def time_backend(embeddings, texts: List[str]) -> tuple:
+    embeddings.embed_documents(texts[:8])  # warm-up
+    start = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    return vectors, len(texts) / elapsed
+
+
+def topk_overlap(reference: np.ndarray, candidate: np.ndarray, k: int = 10, queries: int = 50) -> float:
+    """Average overlap of top-k neighbours when using each row as a query."""
+    overlaps = []
+    for q in range(min(queries, len(reference))):
+        ref_top = set(np.argsort(-(reference @ reference[q]))[:k])
+        cand_top = set(np.argsort(-(candidate @ candidate[q]))[:k])
+        overlaps.append(len(ref_top & cand_top) / k)
+    return float(np.mean(overlaps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--texts", type=int, default=1000)
+    args = parser.parse_args()
+
+    from langchain.embeddings import HuggingFaceEmbeddings
+
+    texts = load_corpus(args.texts)
+    backends = {"pytorch-fp32": HuggingFaceEmbeddings(model_name=settings.embedding_model_name)}
+    for quantize, name in ((False, "onnx-fp32"), (True, "onnx-int8")):
+        try:
+            backends[name] = OnnxEmbeddings(
+                model_name=settings.embedding_model_name,
+                model_dir=settings.onnx_model_dir,
+                quantize=quantize
+            )
+        except FileNotFoundError as e:
+            print(f"Skipping {name}: {e}")
+
+    reference = None
+    print(f"{'backend':<14}{'texts/s':>10}{'speedup':>10}{'mean cos':>10}{'min cos':>10}{'top10':>8}")
+    for name, embeddings in backends.items():
+        vectors, throughput = time_backend(embeddings, texts)
+        if reference is None:
+            reference, base_throughput = vectors, throughput
+        cosines = np.sum(reference * vectors, axis=1)
+        print(
+            f"{name:<14}{throughput:>10.1f}{throughput / base_throughput:>9.2f}x"
+            f"{cosines.mean():>10.5f}{cosines.min():>10.5f}{topk_overlap(reference, vectors):>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
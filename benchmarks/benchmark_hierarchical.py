@@ -0,0 +1,55 @@
+"""Flat versus coarse-to-fine (summary-first) search over the existing index.
+
+For each question, times a flat top-k search over all chunks and a
+hierarchical search that first picks candidate documents from the summary
+index, and reports how many of the flat top-k hits the hierarchical search
+also returns.
+
+Usage:
+    python -m benchmarks.benchmark_hierarchical --questions "What is the refund policy?" --k 5
+"""
+import argparse
+import time
+
+from config.settings import settings
+from src.chatbot.vector_store import VectorStore
+
+DEFAULT_QUESTIONS = [
+    "What is this document about?",
+    "Summarize the main findings.",
+    "What are the key dates mentioned?",
+]
+
+
+def timed_search(store: VectorStore, question: str, k: int, repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        results = store.search(question, k=k)
+    return results, (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", nargs="+", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=settings.hierarchical_candidate_documents)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    store = VectorStore()
+    info = store.get_collection_info()
+    print(f"{info.get('document_count', 0)} chunks, {info.get('summaries', {}).get('documents', 0)} summarized documents\n")
+
+    settings.hierarchical_candidate_documents = args.candidates
+    print(f"{'flat ms':>9}{'hier ms':>9}{'overlap':>9}  question")
+    for question in args.questions:
+        settings.hierarchical_min_documents = 10 ** 9
+        flat, flat_ms = timed_search(store, question, args.k, args.repeats)
+        settings.hierarchical_min_documents = 0
+        hierarchical, hier_ms = timed_search(store, question, args.k, args.repeats)
+        overlap = len({r.content for r in flat} & {r.content for r in hierarchical})
+        print(f"{flat_ms:>9.1f}{hier_ms:>9.1f}{overlap:>6}/{len(flat):<2}  {question}")
+
+
+if __name__ == "__main__":
+    main()
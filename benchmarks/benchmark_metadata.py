@@ -0,0 +1,68 @@
+"""Memory per chunk and per search result: inline source metadata vs doc_id references.
+
+Usage:
+    python -m benchmarks.benchmark_metadata --chunks 100000
+"""
+import argparse
+import json
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from src.chatbot.document_registry import DocumentRegistry
+from src.chatbot.vector_store import SearchResult
+
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--chunks-per-file", type=int, default=200)
+    args = parser.parse_args()
+
+    sources = [f"./data/documents/reports/quarterly_report_{i // args.chunks_per_file}.pdf"
+               for i in range(args.chunks)]
+
+    def legacy_metadata():
+        return [{"source": source, "chunk_id": i, "file_name": Path(source).name,
+                 "file_type": Path(source).suffix.lower()} for i, source in enumerate(sources)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = DocumentRegistry(str(Path(tmp) / "documents.db"))
+
+        def compact_metadata():
+            return [{"doc_id": registry.register(source).doc_id, "chunk_id": i}
+                    for i, source in enumerate(sources)]
+
+        legacy, legacy_bytes = measure(legacy_metadata)
+        compact, compact_bytes = measure(compact_metadata)
+
+        legacy_stored = sum(len(json.dumps(m)) for m in legacy)
+        compact_stored = sum(len(json.dumps(m)) for m in compact)
+
+        def dict_results():
+            return [{"content": "chunk text", "metadata": m, "relevance_score": 0.5} for m in legacy]
+
+        def slot_results():
+            return [SearchResult("chunk text", m, 0.5, registry.get(m["doc_id"])) for m in compact]
+
+        _, dict_result_bytes = measure(dict_results)
+        _, slot_result_bytes = measure(slot_results)
+
+    n = args.chunks
+    print(f"{n} chunks, {args.chunks_per_file} chunks per file")
+    print(f"{'':<28}{'legacy':>12}{'compact':>12}")
+    print(f"{'metadata bytes/chunk (RAM)':<28}{legacy_bytes / n:>12.1f}{compact_bytes / n:>12.1f}")
+    print(f"{'metadata bytes/chunk (JSON)':<28}{legacy_stored / n:>12.1f}{compact_stored / n:>12.1f}")
+    print(f"{'bytes/search result':<28}{dict_result_bytes / n:>12.1f}{slot_result_bytes / n:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Query throughput versus number of read-only API workers.
+
+For each worker count, starts `uvicorn src.api.main:app --workers N` as
+read-only query workers on the existing index, waits for /ready, then keeps
+`--concurrency` clients sending POST /query for `--duration` seconds.
+
+Usage:
+    python -m benchmarks.load_test --workers 1 2 4 --concurrency 32 --duration 30
+    python -m benchmarks.load_test --url http://localhost:8000   # measure a running server
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+
+QUESTIONS = [
+    "What is this document about?",
+    "Summarize the main findings.",
+    "What are the key dates mentioned?",
+    "Who are the people or organizations involved?",
+]
+
+
+def wait_ready(url: str, timeout: float = 600) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/ready", timeout=2).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"{url} did not become ready within {timeout}s")
+
+
+def run_load(url: str, concurrency: int, duration: float) -> Dict[str, float]:
+    stop_at = time.monotonic() + duration
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def client(worker_id: int):
+        session = requests.Session()
+        i = worker_id
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = session.post(f"{url}/query", json={"question": QUESTIONS[i % len(QUESTIONS)]}, timeout=120)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors[0] += 1
+            i += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+
+    latencies.sort()
+    return {
+        "qps": len(latencies) / duration,
+        "p50": latencies[len(latencies) // 2] if latencies else float("nan"),
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else float("nan"),
+        "errors": errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--url", help="Measure an already running server instead of spawning workers")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8}{'qps':>10}{'scaling':>10}{'p50 s':>10}{'p95 s':>10}{'errors':>8}")
+    if args.url:
+        result = run_load(args.url, args.concurrency, args.duration)
+        print(f"{'-':>8}{result['qps']:>10.2f}{'-':>10}{result['p50']:>10.3f}{result['p95']:>10.3f}{result['errors']:>8}")
+        return
+
+    baseline = None
+    for workers in args.workers:
+        env = {**os.environ, "API_ROLE": "reader"}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.api.main:app", "--port", str(args.port),
+             "--workers", str(workers), "--log-level", "warning"],
+            env=env
+        )
+        try:
+            url = f"http://127.0.0.1:{args.port}"
+            wait_ready(url)
+            result = run_load(url, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or result["qps"] / workers
+        scaling = result["qps"] / baseline if baseline else float("nan")
+        print(f"{workers:>8}{result['qps']:>10.2f}{scaling:>9.2f}x{result['p50']:>10.3f}"
+              f"{result['p95']:>10.3f}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,63 @@
 import os
 from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     openai_api_key: str = ""
     chroma_db_path: str = "./data/chroma_db"
     upload_dir: str = "./data/documents"
-    chunk_size: int = 1000
-    chunk_overlap: int = 200
+    chunk_size: int = 256  # tokens
+    chunk_overlap: int = 32  # tokens
+    dedup_chunks: bool = True
+    dedup_max_distance: int = 5  # SimHash bits
     max_tokens: int = 4000
     temperature: float = 0.7
+    warmup_on_startup: bool = True
+    embedding_backend: str = "huggingface"  # "huggingface" or "onnx"
+    embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
+    onnx_model_dir: str = "./data/onnx_model"
+    onnx_quantize: bool = False
+    vector_compression: str = "none"  # "none", "int8" or "float16"
+    compressed_memory_budget_mb: int = 256
+    compressed_rescore_factor: int = 4
+    api_role: str = "standalone"  # "standalone", "writer" or "reader"
+    writer_url: str = "http://127.0.0.1:8001"
+    index_poll_interval: float = 1.0
+    max_in_flight_queries: int = 4
+    max_queued_queries: int = 64
+    max_queue_wait_seconds: float = 30.0
+    batch_max_retries: int = 3  # rejected batch questions are retried this often, then reported as failed
+    default_query_deadline_seconds: Optional[float] = None
+    llm_call_estimate_seconds: float = 3.0
+    query_mode: str = "direct"  # "direct" (single retrieve-then-answer) or "react"
+    direct_top_k: int = 8
+    direct_max_distance: float = 1.2  # best chunk distance above this escalates to ReAct
+    direct_min_confidence: float = 0.6
+    context_candidates: int = 8  # chunks retrieved before context assembly
+    context_token_budget: int = 800
+    observation_token_budget: int = 300
+    context_max_passages: int = 4
+    mmr_lambda: float = 0.7
+    watch_upload_dir: bool = True
+    watch_use_inotify: bool = True  # falls back to polling when unavailable
+    watch_debounce_seconds: float = 2.0
+    watch_max_delay_seconds: float = 30.0
+    watch_poll_interval: float = 5.0
+    snapshot_dir: str = "./data/snapshots"
+    snapshot_keep_versions: int = 2  # earlier index versions kept for rollback
+    summary_index: bool = True
+    summary_method: str = "extractive"  # "extractive" or "llm" (one LLM call per section at ingest)
+    summary_max_sentences: int = 3
+    hierarchical_min_documents: int = 20  # smaller corpora search all chunks directly
+    hierarchical_candidate_documents: int = 5
+    session_db_path: str = "./data/sessions.db"  # shared by all worker processes
+    max_sessions: int = 1000
+    session_idle_seconds: float = 1800.0
+    session_max_turns: int = 20
+    session_history_turns: int = 3  # recent exchanges included in follow-up prompts
+    session_max_retrievals: int = 4
+    session_reuse_min_similarity: float = 0.8  # cosine between follow-up and earlier retrieval queries
     
     class Config:
         env_file = ".env"
@@ -1,13 +1,23 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+import asyncio
+import json
 import shutil
+import time
 import os
+import threading
+import uuid
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Literal, Optional
 import logging
 
 from src.chatbot import chatbot
+from src.chatbot.scheduler import QueryScheduler, QueryRejected
+from src.chatbot.deadline import Deadline
 from config.settings import settings
 
 logging.basicConfig(level=logging.INFO)
@@ -24,30 +34,148 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Bounds concurrent LLM work per process and sheds load early with 429
+scheduler = QueryScheduler(
+    max_in_flight=settings.max_in_flight_queries,
+    max_queue_size=settings.max_queued_queries,
+    max_queue_wait=settings.max_queue_wait_seconds,
+    is_ready=lambda: chatbot.is_ready
+)
+
+# Background upload jobs by id, oldest first; finished jobs beyond the limit are dropped
+upload_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+upload_jobs_lock = threading.Lock()
+MAX_UPLOAD_JOBS = 100
+
 class QueryRequest(BaseModel):
     question: str
+    priority: Literal["interactive", "batch"] = "interactive"
+    # End-to-end time budget in seconds, counted from arrival (including queueing)
+    deadline_seconds: Optional[float] = Field(default=None, gt=0)
+    # Client-chosen conversation id; follow-ups with the same id share history and evidence
+    session_id: Optional[str] = Field(default=None, min_length=1, max_length=128)
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    # Time budget per question, counted from when it is admitted
+    deadline_seconds: Optional[float] = Field(default=None, gt=0)
 
 class QueryResponse(BaseModel):
     query: str
     answer: str
     metadata: Dict[str, Any] = {}
+    session_id: Optional[str] = None
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the chatbot on startup."""
-    try:
-        chatbot.initialize()
-        logger.info("Chatbot initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize chatbot: {e}")
+    """Warm up the chatbot and start the upload directory watcher in the background."""
+    tasks = []
+    if settings.warmup_on_startup:
+        tasks.append(chatbot.warm_up)
+    else:
+        logger.info("Startup warm-up disabled; components will load on first use")
+    if settings.watch_upload_dir and not chatbot.read_only:
+        tasks.append(chatbot.start_watcher)
+    if not tasks:
+        return
+    
+    def run_startup_tasks():
+        for task in tasks:
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Startup task {task.__name__} failed: {e}")
+    
+    threading.Thread(target=run_startup_tasks, name="chatbot-warmup", daemon=True).start()
+    logger.info("Chatbot warm-up started in background")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    chatbot.stop_watcher()
 
 @app.get("/")
 async def root():
     return {"message": "Document QA Chatbot API", "status": "running"}
 
+@app.get("/ready")
+async def readiness():
+    """Report whether the model and index are loaded and ready to answer queries."""
+    readiness = chatbot.get_readiness()
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content=readiness)
+    return readiness
+
+def forward_upload(file: UploadFile, wait: bool = True) -> JSONResponse:
+    """Forward an upload to the writer process that owns the index."""
+    import requests
+    
+    response = requests.post(
+        f"{settings.writer_url}/upload",
+        files={"file": (file.filename, file.file, file.content_type)},
+        params={"wait": str(wait).lower()},
+        timeout=300
+    )
+    if response.status_code not in (200, 202):
+        raise HTTPException(status_code=response.status_code, detail=response.json().get("detail", response.text))
+    return JSONResponse(status_code=response.status_code, content=response.json())
+
+def upload_response(result: Dict[str, Any], filename: str) -> Dict[str, Any]:
+    return {
+        "message": result["message"],
+        "filename": filename,
+        "chunks_added": result["chunk_count"],
+        "duplicates_dropped": (
+            result["chunking"]["exact_duplicates_dropped"]
+            + result["chunking"]["near_duplicates_dropped"]
+        )
+    }
+
+def update_upload_job(job_id: str, **fields):
+    with upload_jobs_lock:
+        upload_jobs[job_id].update(fields, updated_at=time.time())
+
+def run_upload_job(job_id: str, file_path: Path, filename: str):
+    """Ingest an uploaded file in the background, recording its progress on the job."""
+    update_upload_job(job_id, state="processing")
+    try:
+        result = chatbot.add_document(
+            str(file_path),
+            progress=lambda stage, fraction: update_upload_job(job_id, stage=stage, progress=round(fraction, 3))
+        )
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+    finally:
+        chatbot.release_upload(str(file_path))
+    if result["success"]:
+        update_upload_job(job_id, state="done", stage="done", progress=1.0, result=upload_response(result, filename))
+    else:
+        logger.error(f"Upload job {job_id} failed: {result['message']}")
+        update_upload_job(job_id, state="failed", error=result["message"])
+
+def start_upload_job(file_path: Path, filename: str) -> Dict[str, Any]:
+    job_id = uuid.uuid4().hex
+    job = {"job_id": job_id, "filename": filename, "state": "queued", "stage": "saved",
+           "progress": 0.0, "created_at": time.time(), "updated_at": time.time()}
+    with upload_jobs_lock:
+        upload_jobs[job_id] = job
+        for old_id in list(upload_jobs):
+            if len(upload_jobs) <= MAX_UPLOAD_JOBS:
+                break
+            if upload_jobs[old_id]["state"] in ("done", "failed"):
+                del upload_jobs[old_id]
+    threading.Thread(target=run_upload_job, args=(job_id, file_path, filename),
+                     name=f"upload-{job_id[:8]}", daemon=True).start()
+    return {**job, "status_url": f"/upload/jobs/{job_id}"}
+
+# Upload is a plain ``def`` handler and queries run in the scheduler's thread
+# pool, so waiting on model warm-up never blocks the event loop.
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Upload a document to the knowledge base."""
+def upload_document(file: UploadFile = File(...), wait: bool = True):
+    """Upload a document to the knowledge base.
+    
+    With ``wait=false`` the file is ingested in the background and a job is
+    returned at once (202); poll ``/upload/jobs/{job_id}`` for its progress.
+    """
     try:
         # Check file type
         allowed_types = {'.pdf', '.docx', '.txt'}
@@ -59,48 +187,159 @@ async def upload_document(file: UploadFile = File(...)):
                 detail=f"Unsupported file type. Allowed types: {allowed_types}"
             )
         
-        # Save uploaded file
+        # Read-only workers hand uploads to the single writer process
+        if chatbot.read_only:
+            return forward_upload(file, wait)
+        
+        # Save uploaded file; the directory watcher leaves it to this upload until ingested
         file_path = Path(settings.upload_dir) / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        chatbot.claim_upload(str(file_path))
+        try:
+            with open(file_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+        except Exception:
+            chatbot.release_upload(str(file_path))
+            raise
+        
+        if not wait:
+            # The job releases the file once it is ingested
+            return JSONResponse(status_code=202, content=start_upload_job(file_path, file.filename))
         
         # Add to knowledge base
-        result = chatbot.add_document(str(file_path))
+        try:
+            result = chatbot.add_document(str(file_path))
+        finally:
+            chatbot.release_upload(str(file_path))
         
         if result["success"]:
-            return {
-                "message": result["message"],
-                "filename": file.filename,
-                "chunks_added": result["chunk_count"]
-            }
+            return upload_response(result, file.filename)
         else:
             raise HTTPException(status_code=500, detail=result["message"])
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/upload/jobs/{job_id}")
+def get_upload_job(job_id: str):
+    """Report a background upload's state, current stage and progress (0 to 1)."""
+    if chatbot.read_only:
+        import requests
+        response = requests.get(f"{settings.writer_url}/upload/jobs/{job_id}", timeout=10)
+        return JSONResponse(status_code=response.status_code, content=response.json())
+    with upload_jobs_lock:
+        job = upload_jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Upload job not found")
+        return dict(job)
+
 @app.post("/query", response_model=QueryResponse)
 async def query_documents(request: QueryRequest):
     """Query the document knowledge base."""
     try:
-        result = chatbot.query(request.question)
+        deadline = Deadline(request.deadline_seconds or settings.default_query_deadline_seconds)
+        result = await scheduler.run(
+            chatbot.query, request.question, deadline, session_id=request.session_id, priority=request.priority
+        )
         
         return QueryResponse(
             query=result["query"],
             answer=result["answer"],
-            metadata=result.get("metadata", {})
+            metadata=result.get("metadata", {}),
+            session_id=result.get("session_id")
         )
         
+    except QueryRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/batch")
+async def query_documents_batch(request: BatchQueryRequest):
+    """Answer many questions, streaming one NDJSON line per question as it completes.
+    
+    Distinct questions are embedded and retrieved in one batch, then answered
+    as ``batch`` priority work through the shared scheduler, so interactive
+    queries keep precedence and the in-flight limit holds.
+    """
+    try:
+        retrieved = await run_in_threadpool(chatbot.retrieve_batch, request.questions)
+    except Exception as e:
+        logger.error(f"Error preparing batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    positions: Dict[str, List[int]] = {}
+    for index, question in enumerate(request.questions):
+        positions.setdefault(question, []).append(index)
+    # Never hold more queue slots than the scheduler can run at once
+    slots = asyncio.Semaphore(settings.max_in_flight_queries)
+    
+    async def answer(question: str):
+        async with slots:
+            for attempt in range(settings.batch_max_retries + 1):
+                try:
+                    deadline = Deadline(request.deadline_seconds or settings.default_query_deadline_seconds)
+                    return question, await scheduler.run(
+                        chatbot.query, question, deadline, retrieved.get(question), priority="batch"
+                    )
+                except QueryRejected as e:
+                    # Shed repeatedly: fail this item instead of waiting on a saturated server forever
+                    if attempt == settings.batch_max_retries:
+                        return question, {"query": question, "answer": f"Query rejected: {str(e)}", "error": True}
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error(f"Error processing batch query '{question}': {e}")
+                    return question, {"query": question, "answer": f"Error processing query: {str(e)}", "error": True}
+    
+    async def stream():
+        started = time.monotonic()
+        failed = 0
+        tasks = [asyncio.ensure_future(answer(question)) for question in positions]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                question, result = await next_done
+                failed += len(positions[question]) if result.get("error") else 0
+                for index in positions[question]:
+                    line = {"index": index, "query": question, "answer": result["answer"],
+                            "metadata": result.get("metadata", {})}
+                    if result.get("error"):
+                        line["error"] = True
+                    yield json.dumps(line) + "\n"
+            yield json.dumps({"summary": {
+                "questions": len(request.questions),
+                "unique_questions": len(positions),
+                "failed": failed,
+                "elapsed_s": round(time.monotonic() - started, 3)
+            }}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    """Return a conversation's condensed history."""
+    session = chatbot.sessions.get(session_id, create=False)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session.to_dict()
+
+@app.delete("/sessions/{session_id}")
+def end_session(session_id: str):
+    """Forget a conversation's history and cached evidence."""
+    if not chatbot.end_session(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"message": f"Session {session_id} ended"}
+
 @app.get("/stats")
 async def get_stats():
     """Get chatbot statistics."""
     try:
-        return chatbot.get_stats()
+        return {**chatbot.get_stats(), "scheduler": scheduler.get_metrics()}
     except Exception as e:
         logger.error(f"Error getting stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
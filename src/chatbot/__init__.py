@@ -1,8 +1,20 @@
+import json
 import logging
-from typing import Dict, Any, List
+import os
+import threading
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Any, Iterator, List, Optional, Set, Tuple
 from .document_processor import DocumentProcessor
-from .vector_store import VectorStore
+from .vector_store import VectorStore, SearchResult
 from .executor import QueryExecutor
+from .index_version import IndexVersion
+from .deadline import Deadline
+from .watcher import DirectoryWatcher, fingerprint, snapshot_directory
+from .snapshot import file_sha256
+from .sessions import Session, SessionStore
+from .document_registry import get_document_registry
 from config.settings import settings
 
 logging.basicConfig(level=logging.INFO)
@@ -10,39 +22,275 @@ logger = logging.getLogger(__name__)
 
 class DocumentQAChatbot:
     def __init__(self):
-        self.document_processor = DocumentProcessor()
-        self.vector_store = VectorStore()
-        self.executor = QueryExecutor(self.vector_store)
+        # Heavy components (embedding model, Chroma, LLM clients) are built on
+        # first use so that importing this module stays cheap.
+        self._document_processor: Optional[DocumentProcessor] = None
+        self._vector_store: Optional[VectorStore] = None
+        self._executor: Optional[QueryExecutor] = None
+        self._lock = threading.RLock()
         self._initialized = False
+        self._warming_up = False
+        self._warmup_error: Optional[str] = None
+        self.startup_timings: Dict[str, float] = {}
+        # Read-only workers serve queries from an index owned by a single writer
+        self.read_only = settings.api_role == "reader"
+        self._index_version: Optional[IndexVersion] = None
+        # (mtime_ns, size) of each file as it was last ingested, to skip unchanged files
+        self._ingested: Dict[str, Tuple[int, int]] = {}
+        self._checksums: Dict[str, str] = {}
+        self._ingest_lock = threading.Lock()
+        # Files an upload is writing or ingesting; the watcher leaves them to the upload
+        self._uploads: Set[str] = set()
+        self._watcher: Optional[DirectoryWatcher] = None
+        self.sync_stats = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+        self.sessions = SessionStore(
+            settings.session_db_path,
+            max_sessions=settings.max_sessions,
+            idle_seconds=settings.session_idle_seconds,
+            max_turns=settings.session_max_turns,
+            max_retrievals=settings.session_max_retrievals,
+            # Cached evidence is re-linked to its documents when a session is loaded
+            resolve=lambda metadata: get_document_registry().resolve(metadata)
+        )
+    
+    def _build(self, name: str, factory):
+        """Build a component and record how long it took."""
+        start = time.perf_counter()
+        component = factory()
+        self.startup_timings[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"Loaded {name} in {self.startup_timings[name]:.3f}s")
+        return component
+    
+    @property
+    def document_processor(self) -> DocumentProcessor:
+        if self._document_processor is None:
+            with self._lock:
+                if self._document_processor is None:
+                    self._document_processor = self._build("document_processor", DocumentProcessor)
+        return self._document_processor
+    
+    @property
+    def vector_store(self) -> VectorStore:
+        if self._vector_store is None:
+            with self._lock:
+                if self._vector_store is None:
+                    self._vector_store = self._build("vector_store", VectorStore)
+        return self._vector_store
+    
+    @property
+    def executor(self) -> QueryExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    vector_store = self.vector_store
+                    self._executor = self._build("executor", lambda: QueryExecutor(vector_store))
+        return self._executor
+    
+    @property
+    def index_version(self) -> IndexVersion:
+        if self._index_version is None:
+            self._index_version = IndexVersion(settings.chroma_db_path, settings.index_poll_interval)
+        return self._index_version
+    
+    def _refresh_index(self):
+        """Reopen the index when another process published a new version (an ingest or a snapshot restore)."""
+        if not self.index_version.changed():
+            return
+        self.vector_store.reload()
+        if not self.read_only:
+            # A restored or rolled-back index brings its own ingestion state. Files
+            # are not re-synced here, so a rollback is not undone by the same files.
+            with self._ingest_lock:
+                self._apply_ingest_state(self._load_ingest_state() or {"files": {}})
+    
+    @property
+    def _ingest_state_path(self) -> Path:
+        return Path(settings.chroma_db_path) / "ingest_state.json"
+    
+    def _load_ingest_state(self) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._ingest_state_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+    
+    def _save_ingest_state(self):
+        """Persist per-file fingerprints inside the index directory, so they travel with snapshots."""
+        files = {
+            path: {"mtime_ns": mtime_ns, "size": size, "sha256": self._checksums.get(path)}
+            for path, (mtime_ns, size) in self._ingested.items()
+        }
+        tmp = self._ingest_state_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"files": files}))
+        tmp.replace(self._ingest_state_path)
+    
+    def _apply_ingest_state(self, state: Dict[str, Any]) -> List[str]:
+        """Adopt persisted fingerprints and return the files that changed since they were ingested.
+        
+        A file whose mtime differs but whose size and SHA-256 match (e.g. copied
+        to a new replica) counts as unchanged.
+        """
+        files = state.get("files", {})
+        current = snapshot_directory(settings.upload_dir)
+        self._ingested, self._checksums, changed = {}, {}, []
+        for path, entry in files.items():
+            recorded = (entry["mtime_ns"], entry["size"])
+            self._checksums[path] = entry.get("sha256")
+            observed = current.get(path)
+            if observed is not None and (observed == recorded or (
+                    observed[1] == recorded[1] and entry.get("sha256") == file_sha256(Path(path)))):
+                self._ingested[path] = observed
+            else:
+                self._ingested[path] = recorded
+                changed.append(path)
+        changed.extend(path for path in current if path not in files)
+        return changed
+    
+    @property
+    def is_ready(self) -> bool:
+        """Whether all heavy components are loaded and documents are indexed."""
+        return self._initialized and self._executor is not None
     
     def initialize(self):
         """Initialize the chatbot by loading existing documents."""
+        with self._lock:
+            if self._initialized:
+                return
+            if self.read_only:
+                # Ingestion belongs to the writer process
+                self._initialized = True
+                return
+            try:
+                start = time.perf_counter()
+                state = self._load_ingest_state()
+                if state is not None:
+                    # Resume from the index on disk: only changed files are processed
+                    changed = self._apply_ingest_state(state)
+                    logger.info(f"Resumed index with {len(self._ingested)} files; "
+                                f"{len(changed)} files changed since")
+                    if changed:
+                        self.sync_changes(changed)
+                else:
+                    # Load documents from the upload directory
+                    snapshot = snapshot_directory(settings.upload_dir)
+                    documents = self.document_processor.process_directory(settings.upload_dir)
+                    if documents:
+                        self.vector_store.add_documents(documents)
+                        logger.info(f"Initialized with {len(documents)} document chunks")
+                    else:
+                        logger.info("No documents found in upload directory")
+                    self._ingested.update(snapshot)
+                    self._checksums.update({path: file_sha256(Path(path)) for path in snapshot})
+                    self._save_ingest_state()
+                    if documents:
+                        self.index_version.bump(chunks=len(documents))
+                
+                self.startup_timings["initialize"] = round(time.perf_counter() - start, 3)
+                self._initialized = True
+                
+            except Exception as e:
+                logger.error(f"Error initializing chatbot: {e}")
+                raise
+    
+    def _ensure_ready(self):
+        """Build all components and index documents, recording cold-start time once."""
+        with self._lock:
+            if self.is_ready:
+                return
+            start = time.perf_counter()
+            # Record the index version before loading so no later publish is missed
+            _ = self.index_version
+            _ = self.executor
+            self.initialize()
+            self.startup_timings["cold_start"] = round(time.perf_counter() - start, 3)
+            logger.info(f"Chatbot ready after {self.startup_timings['cold_start']:.3f}s cold start")
+    
+    def warm_up(self) -> Dict[str, float]:
+        """Eagerly load all components and documents in the background."""
+        self._warming_up = True
+        self._warmup_error = None
         try:
-            # Load documents from the upload directory
-            documents = self.document_processor.process_directory(settings.upload_dir)
-            if documents:
-                self.vector_store.add_documents(documents)
-                logger.info(f"Initialized with {len(documents)} document chunks")
-            else:
-                logger.info("No documents found in upload directory")
-            
-            self._initialized = True
-            
+            self._ensure_ready()
         except Exception as e:
-            logger.error(f"Error initializing chatbot: {e}")
-            raise
+            self._warmup_error = str(e)
+            logger.error(f"Error warming up chatbot: {e}")
+        finally:
+            self._warming_up = False
+        return dict(self.startup_timings)
+    
+    def get_readiness(self) -> Dict[str, Any]:
+        """Report whether the engine is warm, without triggering any loading."""
+        readiness = {
+            "ready": self.is_ready,
+            "warming_up": self._warming_up,
+            "startup_timings": dict(self.startup_timings)
+        }
+        if self._warmup_error:
+            readiness["error"] = self._warmup_error
+        return readiness
+    
+    def claim_upload(self, file_path: str):
+        """Mark a file as owned by an upload until ``release_upload``, so the watcher skips it."""
+        with self._lock:
+            self._uploads.add(file_path)
     
-    def add_document(self, file_path: str) -> Dict[str, Any]:
-        """Add a new document to the knowledge base."""
+    def release_upload(self, file_path: str):
+        with self._lock:
+            self._uploads.discard(file_path)
+    
+    def add_document(self, file_path: str,
+                     progress: Optional[Callable[[str, float], None]] = None,
+                     if_changed: bool = False) -> Dict[str, Any]:
+        """Add a new document to the knowledge base.
+        
+        ``progress`` is called with a stage name and the fraction of work done.
+        With ``if_changed``, a file whose fingerprint matches its last ingest is
+        skipped; the check runs under the ingest lock, so an ingest that
+        finishes meanwhile is seen.
+        """
+        progress = progress or (lambda stage, fraction: None)
+        if self.read_only:
+            return {
+                "success": False,
+                "message": "This worker is read-only; uploads are handled by the writer"
+            }
         try:
-            documents = self.document_processor.process_document(file_path)
+            self._refresh_index()
+            with self._ingest_lock:
+                current = fingerprint(file_path)
+                if if_changed and current is not None and current == self._ingested.get(file_path):
+                    return {
+                        "success": True,
+                        "unchanged": True,
+                        "message": f"{file_path} is already up to date",
+                        "chunk_count": 0
+                    }
+                checksum = file_sha256(Path(file_path))
+                # A re-ingested file replaces its previous chunks
+                replaced = self.vector_store.delete_source(file_path) if file_path in self._ingested else 0
+                progress("extracting", 0.05)
+                documents = self.document_processor.process_document(file_path)
+                if documents:
+                    # Embedding dominates ingestion time; report it batch by batch
+                    progress("embedding", 0.1)
+                    ids = self.vector_store.add_documents(
+                        documents, progress=lambda done, total: progress("embedding", 0.1 + 0.85 * done / total)
+                    )
+                    self._ingested[file_path] = current
+                    self._checksums[file_path] = checksum
+                    self._save_ingest_state()
+                    self.index_version.bump(source=file_path, chunks=len(documents))
+                elif replaced:
+                    self._ingested.pop(file_path, None)
+                    self._checksums.pop(file_path, None)
+                    self._save_ingest_state()
+                    self.index_version.bump(source=file_path, deleted=replaced)
             if documents:
-                ids = self.vector_store.add_documents(documents)
                 return {
                     "success": True,
                     "message": f"Added {len(documents)} chunks from {file_path}",
                     "chunk_count": len(documents),
-                    "document_ids": ids
+                    "document_ids": ids,
+                    "chunking": self.document_processor.last_stats
                 }
             else:
                 return {
@@ -56,13 +304,106 @@ class DocumentQAChatbot:
                 "message": f"Error adding document: {str(e)}"
             }
     
-    def query(self, question: str) -> Dict[str, Any]:
-        """Process a query and return answer."""
-        if not self._initialized:
-            self.initialize()
+    def remove_document(self, file_path: str) -> Dict[str, Any]:
+        """Remove a document's chunks from the knowledge base."""
+        if self.read_only:
+            return {
+                "success": False,
+                "message": "This worker is read-only; deletions are handled by the writer"
+            }
+        try:
+            self._refresh_index()
+            with self._ingest_lock:
+                removed = self.vector_store.delete_source(file_path)
+                if self._ingested.pop(file_path, None) is not None:
+                    self._checksums.pop(file_path, None)
+                    self._save_ingest_state()
+                if removed:
+                    self.index_version.bump(source=file_path, deleted=removed)
+            return {
+                "success": True,
+                "message": f"Removed {removed} chunks of {file_path}",
+                "chunk_count": removed
+            }
+        except Exception as e:
+            logger.error(f"Error removing document {file_path}: {e}")
+            return {
+                "success": False,
+                "message": f"Error removing document: {str(e)}"
+            }
+    
+    def sync_changes(self, paths: List[str]) -> Dict[str, int]:
+        """Bring the index in line with the files at ``paths``: ingest new or modified ones, drop deleted ones."""
+        synced = {key: 0 for key in self.sync_stats}
+        for path in paths:
+            with self._lock:
+                uploading = path in self._uploads
+            current = fingerprint(path)
+            known = self._ingested.get(path)
+            if uploading:
+                synced["skipped"] += 1
+            elif current is None:
+                result = self.remove_document(path)
+                if not result["success"]:
+                    synced["failed"] += 1
+                elif known is not None or result["chunk_count"]:
+                    synced["deleted"] += 1
+            elif current == known:
+                synced["unchanged"] += 1
+            else:
+                result = self.add_document(path, if_changed=True)
+                if not result["success"]:
+                    synced["failed"] += 1
+                elif result.get("unchanged"):
+                    synced["unchanged"] += 1
+                else:
+                    synced["updated" if known is not None else "added"] += 1
+        for key, value in synced.items():
+            self.sync_stats[key] += value
+        if any(synced[key] for key in ("added", "updated", "deleted", "failed")):
+            logger.info(f"Synced upload directory changes: {synced}")
+        return synced
+    
+    def start_watcher(self) -> Optional[DirectoryWatcher]:
+        """Ingest changes to the upload directory in the background (writer or standalone only)."""
+        if self.read_only or self._watcher is not None:
+            return self._watcher
+        self._ensure_ready()
+        watcher = DirectoryWatcher(
+            settings.upload_dir,
+            self.sync_changes,
+            debounce_seconds=settings.watch_debounce_seconds,
+            max_delay_seconds=settings.watch_max_delay_seconds,
+            poll_interval=settings.watch_poll_interval,
+            use_inotify=settings.watch_use_inotify
+        )
+        watcher.start()
+        self._watcher = watcher
+        # Catch up on changes made between the initial ingest and the first snapshot
+        self.sync_changes(sorted(set(snapshot_directory(settings.upload_dir)) | set(self._ingested)))
+        return watcher
+    
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+    
+    def query(self, question: str, deadline: Optional[Deadline] = None,
+              retrieved: Optional[List[SearchResult]] = None,
+              session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Process a query and return answer, within the deadline's time budget if given.
+        
+        With a ``session_id`` the question is answered as part of that
+        conversation (created on first use), see ``_session_query``.
+        """
+        self._ensure_ready()
+        self._refresh_index()
         
         try:
-            result = self.executor.execute_query(question)
+            if session_id is not None:
+                with self.sessions.open(session_id) as session:
+                    return self._session_query(session, question, deadline, retrieved)
+            result = self.executor.execute_query(question, deadline=deadline, retrieved=retrieved)
             return result
         except Exception as e:
             logger.error(f"Error processing query '{question}': {e}")
@@ -72,15 +413,110 @@ class DocumentQAChatbot:
                 "error": True
             }
     
+    def _session_query(self, session: Session, question: str, deadline: Optional[Deadline],
+                       retrieved: Optional[List[SearchResult]] = None) -> Dict[str, Any]:
+        """Answer a question in a conversation, reusing its cached evidence when the topic holds.
+        
+        A follow-up is retrieved for together with the previous question, so
+        references like "what about section 3?" keep their subject. When that
+        query is close to an earlier retrieval of the session, its chunks are
+        reused and the search is skipped; the direct answer still escalates to
+        ReAct (which searches afresh) if the cached evidence is not enough.
+        """
+        follow_up = session.is_follow_up
+        evidence_reused = False
+        if retrieved is None and settings.query_mode == "direct":
+            search_query = f"{session.last_question()} {question}" if follow_up else question
+            vector = self.vector_store.embeddings.embed_query(search_query)
+            version = self.index_version.version
+            retrieved = session.cached_evidence(vector, settings.session_reuse_min_similarity, version)
+            evidence_reused = retrieved is not None
+            if retrieved is None:
+                retrieved = self.vector_store.search_batch([search_query], k=settings.direct_top_k, vectors=[vector])[0]
+                session.remember_evidence(vector, retrieved, version)
+        
+        history = session.history_text(settings.session_history_turns)
+        result = self.executor.execute_query(question, deadline=deadline, retrieved=retrieved, history=history or None)
+        session.add_turn(question, result.get("answer", ""))
+        self.sessions.record_query(follow_up, follow_up and evidence_reused)
+        result.setdefault("metadata", {})["session"] = {
+            "session_id": session.session_id,
+            "turn": len(session.turns),
+            "follow_up": follow_up,
+            "evidence_reused": evidence_reused
+        }
+        result["session_id"] = session.session_id
+        return result
+    
+    def end_session(self, session_id: str) -> bool:
+        return self.sessions.delete(session_id)
+    
+    def retrieve_batch(self, questions: List[str]) -> Dict[str, List[SearchResult]]:
+        """Retrieve evidence for the distinct questions with one batched search.
+        
+        Only direct mode answers from this first retrieval; in ReAct mode the
+        agent chooses its own searches, so nothing is prefetched.
+        """
+        self._ensure_ready()
+        self._refresh_index()
+        
+        unique = list(dict.fromkeys(questions))
+        if settings.query_mode != "direct" or not unique:
+            return {}
+        return dict(zip(unique, self.vector_store.search_batch(unique, k=settings.direct_top_k)))
+    
+    def query_batch(self, questions: List[str], max_concurrency: Optional[int] = None,
+                    deadline_seconds: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Answer many questions, yielding each result with its ``index`` as soon as it completes.
+        
+        Identical questions are answered once and the result is yielded for
+        every position they occupy. Each question's deadline starts when a
+        worker picks it up, not when the batch is submitted.
+        """
+        positions: Dict[str, List[int]] = {}
+        for index, question in enumerate(questions):
+            positions.setdefault(question, []).append(index)
+        retrieved = self.retrieve_batch(questions)
+        
+        def answer(question: str) -> Dict[str, Any]:
+            return self.query(question, Deadline(deadline_seconds), retrieved.get(question))
+        
+        with ThreadPoolExecutor(max_workers=max_concurrency or settings.max_in_flight_queries) as pool:
+            futures = {pool.submit(answer, question): question for question in positions}
+            for future in as_completed(futures):
+                question = futures[future]
+                result = future.result()
+                for index in positions[question]:
+                    yield {"index": index, **result}
+    
     def get_stats(self) -> Dict[str, Any]:
         """Get chatbot statistics."""
         try:
-            collection_info = self.vector_store.get_collection_info()
-            return {
+            # Answer immediately while the vector store is still loading
+            if self._vector_store is None:
+                return {
+                    "initialized": self._initialized,
+                    "document_chunks": None,
+                    **self.get_readiness()
+                }
+            
+            collection_info = self._vector_store.get_collection_info()
+            stats = {
+                "role": settings.api_role,
+                "index_version": self.index_version.version,
                 "initialized": self._initialized,
                 "document_chunks": collection_info.get("document_count", 0),
-                "vector_store_info": collection_info
+                "vector_store_info": collection_info,
+                **self.get_readiness()
             }
+            if self._document_processor is not None:
+                stats["ingestion"] = dict(self._document_processor.stats)
+            if self._executor is not None:
+                stats["execution"] = self._executor.get_metrics()
+            stats["sessions"] = self.sessions.get_metrics()
+            if self._watcher is not None:
+                stats["watcher"] = {**self._watcher.get_metrics(), **self.sync_stats}
+            return stats
         except Exception as e:
             logger.error(f"Error getting stats: {e}")
             return {"error": str(e)}
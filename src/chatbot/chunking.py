@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import re
+from collections import Counter, defaultdict
+from typing import List, Dict, Any, Optional, Union
+import numpy as np
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAGE_BREAK = "\f"
+HEADING_PATTERN = re.compile(
+    r"^(#{1,6}\s+\S.*"                     # markdown heading
+    r"|\d+(\.\d+)*\.?\s+[A-Z][^.]{0,80}"   # numbered heading: "2.1 Scope"
+    r"|[A-Z][A-Z0-9 ,:&'()/-]{3,80})$"     # ALL CAPS heading
+)
+APPROXIMATE_TOKEN = re.compile(r"\s*(?:\w+|[^\w\s])")
+
+
+class ApproximateEncoding:
+    """Offline stand-in for a tiktoken encoding: one token per word or punctuation mark.
+
+    Tokens keep their leading whitespace, so ``decode`` restores the text.
+    """
+
+    name = "approximate"
+
+    def encode(self, text: str, **kwargs) -> List[str]:
+        return APPROXIMATE_TOKEN.findall(text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+def get_encoding(encoding_name: str) -> Union["tiktoken.Encoding", ApproximateEncoding]:
+    """The tiktoken encoding, or an approximation when its BPE file cannot be loaded (e.g. offline)."""
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding {encoding_name} ({e}); approximating token counts")
+        return ApproximateEncoding()
+
+
+class StructuredChunker:
+    """Split text into token-bounded chunks that follow document structure.
+
+    Text is parsed into headings, paragraphs and tables per page (pages are
+    separated by form feeds). Blocks are packed into chunks of at most
+    ``chunk_size`` tokens; a heading always starts a new chunk, tables are kept
+    whole when they fit, and overlap is made of whole trailing blocks.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, encoding_name: str = "cl100k_base"):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = get_encoding(encoding_name)
+        # Fallback for single blocks that exceed the chunk size
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=self.count_tokens
+        )
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    @staticmethod
+    def _is_table_line(line: str) -> bool:
+        return line.count("|") >= 2 or line.count("\t") >= 2
+
+    def parse_blocks(self, text: str) -> List[Dict[str, Any]]:
+        """Parse text into heading, paragraph and table blocks with page numbers."""
+        blocks = []
+        for page_number, page in enumerate(text.split(PAGE_BREAK), 1):
+            buffer: List[str] = []
+            buffer_kind = "paragraph"
+
+            def flush():
+                if buffer:
+                    blocks.append({"kind": buffer_kind, "text": "\n".join(buffer), "page": page_number})
+                    buffer.clear()
+
+            for raw_line in page.splitlines():
+                line = raw_line.strip()
+                if not line:
+                    flush()
+                    continue
+                if HEADING_PATTERN.match(line):
+                    flush()
+                    blocks.append({"kind": "heading", "text": line.lstrip("# ").strip(), "page": page_number})
+                    continue
+                kind = "table" if self._is_table_line(line) else "paragraph"
+                if kind != buffer_kind:
+                    flush()
+                    buffer_kind = kind
+                buffer.append(line)
+            flush()
+        return blocks
+
+    def split(self, text: str) -> List[Dict[str, Any]]:
+        """Return chunks as dicts with text, token count, pages and section."""
+        chunks: List[Dict[str, Any]] = []
+        current: List[Dict[str, Any]] = []
+        current_tokens = 0
+        section: Optional[str] = None
+
+        def emit(blocks: List[Dict[str, Any]]):
+            chunks.append({
+                "text": "\n\n".join(block["text"] for block in blocks),
+                "tokens": sum(block["tokens"] for block in blocks),
+                "page": blocks[0]["page"],
+                "page_end": blocks[-1]["page"],
+                "section": section,
+                "has_table": any(block["kind"] == "table" for block in blocks)
+            })
+
+        def overlap_tail(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            tail, tokens = [], 0
+            for block in reversed(blocks):
+                if block["kind"] == "heading" or tokens + block["tokens"] > self.chunk_overlap:
+                    break
+                tail.insert(0, block)
+                tokens += block["tokens"]
+            return tail
+
+        for block in self.parse_blocks(text):
+            block["tokens"] = self.count_tokens(block["text"])
+
+            if block["kind"] == "heading":
+                if any(b["kind"] != "heading" for b in current):
+                    emit(current)
+                section = block["text"]
+                current, current_tokens = [block], block["tokens"]
+                continue
+
+            if block["tokens"] > self.chunk_size:
+                if current and any(b["kind"] != "heading" for b in current):
+                    emit(current)
+                current, current_tokens = [], 0
+                for piece in self.text_splitter.split_text(block["text"]):
+                    emit([{**block, "text": piece, "tokens": self.count_tokens(piece)}])
+                continue
+
+            if current and current_tokens + block["tokens"] > self.chunk_size:
+                emit(current)
+                current = overlap_tail(current)
+                current_tokens = sum(b["tokens"] for b in current)
+                if current_tokens + block["tokens"] > self.chunk_size:
+                    current, current_tokens = [], 0
+
+            current.append(block)
+            current_tokens += block["tokens"]
+
+        if current and any(b["kind"] != "heading" for b in current):
+            emit(current)
+        return chunks
+
+
+def remove_repeated_lines(text: str, min_pages: int = 3, min_fraction: float = 0.5) -> tuple:
+    """Strip running headers and footers: short lines repeated on most pages.
+
+    Digits are normalized so "Page 3 of 10" and "Page 4 of 10" count as the same line.
+    Returns the cleaned text and the number of lines removed.
+    """
+    pages = text.split(PAGE_BREAK)
+    if len(pages) < min_pages:
+        return text, 0
+
+    def normalize(line: str) -> str:
+        return re.sub(r"\d+", "0", line.strip().lower())
+
+    counts = Counter()
+    for page in pages:
+        counts.update({normalize(line) for line in page.splitlines() if 0 < len(line.strip()) <= 100})
+    threshold = max(min_pages, int(len(pages) * min_fraction))
+    repeated = {line for line, count in counts.items() if count >= threshold}
+    if not repeated:
+        return text, 0
+
+    removed = 0
+    cleaned_pages = []
+    for page in pages:
+        kept = []
+        for line in page.splitlines():
+            if normalize(line) in repeated:
+                removed += 1
+            else:
+                kept.append(line)
+        cleaned_pages.append("\n".join(kept))
+    return PAGE_BREAK.join(cleaned_pages), removed
+
+
+class ChunkDeduplicator:
+    """Detect exact and near-duplicate chunks with content hashes and 64-bit SimHash.
+
+    Near-duplicate lookup splits each SimHash into ``max_distance + 1`` bands;
+    by the pigeonhole principle two hashes within ``max_distance`` bits share
+    at least one band exactly, so only those candidates are compared.
+    """
+
+    def __init__(self, max_distance: int = 5, shingle_size: int = 2):
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.num_bands = max_distance + 1
+        self.band_bits = 64 // self.num_bands
+        self.exact: Dict[str, str] = {}
+        self.bands: List[Dict[int, List[tuple]]] = [defaultdict(list) for _ in range(self.num_bands)]
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def simhash(self, text: str) -> int:
+        words = re.sub(r"\d+", "0", self._normalize(text)).split()
+        if not words:
+            return 0
+        size = min(self.shingle_size, len(words))
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles],
+            dtype=np.uint64
+        )
+        bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        weights = (2 * bits.astype(np.int32) - 1).sum(axis=0)
+        return int(np.packbits(weights > 0, bitorder="little").view(np.uint64)[0])
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (i * self.band_bits)) & mask for i in range(self.num_bands)]
+
+    def check(self, text: str, source: str) -> Optional[str]:
+        """Return "exact" or "near" for duplicates; otherwise register the chunk and return None."""
+        digest = hashlib.sha1(self._normalize(text).encode()).hexdigest()
+        if digest in self.exact:
+            return "exact"
+
+        fingerprint = self.simhash(text)
+        keys = self._band_keys(fingerprint)
+        for band, key in zip(self.bands, keys):
+            for other, _ in band.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return "near"
+
+        self.exact[digest] = source
+        for band, key in zip(self.bands, keys):
+            band[key].append((fingerprint, source))
+        return None
+
+    def remove_source(self, source: str):
+        """Forget all chunks registered by a source so it can be re-ingested."""
+        self.exact = {digest: src for digest, src in self.exact.items() if src != source}
+        for band in self.bands:
+            for key in list(band):
+                band[key] = [entry for entry in band[key] if entry[1] != source]
+                if not band[key]:
+                    del band[key]
@@ -0,0 +1,260 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import List, Tuple, Optional, Iterable
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CODE_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+
+class CompressedVectorIndex:
+    """Brute-force vector index over int8 or float16 codes with exact re-scoring.
+
+    Layout under ``path`` (all raw, row-major, memory-mappable):
+      - ``codes.bin``: quantized vectors (int8 or float16), N x dim
+      - ``scales.bin``: per-vector float32 scale (int8 only), N
+      - ``full.bin``: full-precision float32 vectors, N x dim, only read for re-scoring
+      - ``index.json``: dim, count, mode, generation, ids and tombstoned ids
+
+    Codes are held in RAM when they fit within ``memory_budget_mb`` and are
+    memory-mapped otherwise. Full-precision vectors always stay on disk.
+    Once tombstones exceed ``compact_ratio`` of the rows, the live rows are
+    rewritten into files of the next generation (``codes.<generation>.bin``)
+    and ``index.json`` is switched to them in one atomic replace.
+
+    Mutations hold a lock and replace (never mutate in place) the id list,
+    tombstone set and arrays; searches take a consistent view of them under
+    the lock and score it without holding the lock.
+    """
+
+    def __init__(self, path: str, mode: str = "int8", memory_budget_mb: int = 256, rescore_factor: int = 4,
+                 compact_ratio: float = 0.25):
+        if mode not in CODE_DTYPES:
+            raise ValueError(f"Unsupported compression mode: {mode}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.mode = mode
+        self.memory_budget_mb = memory_budget_mb
+        self.rescore_factor = rescore_factor
+        self.compact_ratio = compact_ratio
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self.ids: List[str] = []
+        self.deleted: frozenset = frozenset()
+        self._codes = None
+        self._scales = None
+        self._full = None
+        self._rows: Optional[dict] = None
+        self._lock = threading.RLock()
+        self._load_meta()
+
+    @property
+    def count(self) -> int:
+        return len(self.ids) - len(self.deleted)
+
+    def _file(self, name: str, generation: Optional[int] = None) -> Path:
+        generation = self.generation if generation is None else generation
+        if generation and name.endswith(".bin"):
+            name = f"{name[:-4]}.{generation}.bin"
+        return self.path / name
+
+    def _load_meta(self):
+        meta_file = self._file("index.json")
+        if not meta_file.exists():
+            return
+        meta = json.loads(meta_file.read_text())
+        if meta["mode"] != self.mode:
+            raise ValueError(f"Index at {self.path} was built with mode {meta['mode']}, not {self.mode}")
+        with self._lock:
+            self.dim = meta["dim"]
+            self.generation = meta.get("generation", 0)
+            self.ids = meta["ids"]
+            self.deleted = frozenset(meta.get("deleted", []))
+            self._open_arrays()
+
+    def _save_meta(self):
+        meta = {"mode": self.mode, "dim": self.dim, "count": len(self.ids), "generation": self.generation,
+                "ids": self.ids, "deleted": sorted(self.deleted)}
+        tmp = self._file("index.json.tmp")
+        tmp.write_text(json.dumps(meta))
+        tmp.replace(self._file("index.json"))
+
+    def _open_arrays(self):
+        """(Re)open the on-disk arrays, loading codes into RAM if they fit the budget."""
+        self._rows = None
+        n = len(self.ids)
+        if n == 0:
+            self._codes = self._scales = self._full = None
+            return
+
+        code_dtype = CODE_DTYPES[self.mode]
+        codes = np.memmap(self._file("codes.bin"), dtype=code_dtype, mode="r", shape=(n, self.dim))
+        if codes.nbytes <= self.memory_budget_mb * 1024 * 1024:
+            codes = np.array(codes)
+        scales = None
+        if self.mode == "int8":
+            scales = np.array(np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r", shape=(n,)))
+        full = np.memmap(self._file("full.bin"), dtype=np.float32, mode="r", shape=(n, self.dim))
+        self._codes, self._scales, self._full = codes, scales, full
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.mode == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.round(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _append(self, name: str, data: np.ndarray, rows: int):
+        """Write rows after the first ``rows`` rows, dropping any tail left by an interrupted add."""
+        path = self._file(name)
+        row_bytes = data.nbytes // len(data)
+        with open(path, "r+b" if path.exists() else "wb") as f:
+            f.truncate(rows * row_bytes)
+            f.seek(rows * row_bytes)
+            f.write(data.tobytes())
+
+    def add(self, ids: List[str], vectors) -> None:
+        """Append vectors; re-adding an existing id tombstones the old row."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(ids) != len(vectors):
+            raise ValueError("ids and vectors must have the same length")
+        if len(ids) == 0:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected vectors of dimension {self.dim}, got {vectors.shape[1]}")
+
+            self._tombstone(set(ids))
+            codes, scales = self._quantize(vectors)
+            rows = len(self.ids)
+            self._append("codes.bin", codes, rows)
+            if scales is not None:
+                self._append("scales.bin", scales, rows)
+            self._append("full.bin", vectors, rows)
+
+            self.ids = self.ids + list(ids)
+            self._save_meta()
+            self._open_arrays()
+            self._maybe_compact()
+
+    def _tombstone(self, ids: set) -> int:
+        rows = {i for i, id_ in enumerate(self.ids) if id_ in ids and i not in self.deleted}
+        if rows:
+            self.deleted = self.deleted | rows
+            self._rows = None
+        return len(rows)
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """Tombstone the given ids; they are skipped by search."""
+        with self._lock:
+            removed = self._tombstone(set(ids))
+            if removed:
+                self._save_meta()
+                self._maybe_compact()
+        return removed
+
+    def _maybe_compact(self):
+        if self.deleted and len(self.deleted) > self.compact_ratio * len(self.ids):
+            self.compact()
+
+    def compact(self, block_rows: int = 65536):
+        """Rewrite the live rows into next-generation files and drop the tombstoned ones."""
+        with self._lock:
+            keep = np.array([i for i in range(len(self.ids)) if i not in self.deleted], dtype=np.int64)
+            old_generation, new_generation = self.generation, self.generation + 1
+            names = ["codes.bin", "full.bin"] + (["scales.bin"] if self.mode == "int8" else [])
+            sources = {"codes.bin": self._codes, "full.bin": self._full, "scales.bin": self._scales}
+            for name in names:
+                with open(self._file(name, new_generation), "wb") as f:
+                    for start in range(0, len(keep), block_rows):
+                        f.write(np.asarray(sources[name][keep[start:start + block_rows]]).tobytes())
+
+            self.ids = [self.ids[i] for i in keep]
+            self.deleted = frozenset()
+            self.generation = new_generation
+            self._save_meta()
+            self._open_arrays()
+            for name in names:
+                # Searches still holding the old arrays keep reading the unlinked files
+                self._file(name, old_generation).unlink(missing_ok=True)
+            logger.info(f"Compacted compressed index to {len(self.ids)} rows (generation {new_generation})")
+
+    def _view(self):
+        """A consistent snapshot of the index state; searches score it without holding the lock."""
+        with self._lock:
+            return self.ids, self.deleted, self._codes, self._scales, self._full
+
+    @staticmethod
+    def _approximate_scores(codes, scales, deleted, queries: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+        """Dot products of the codes with a (dim, n_queries) matrix, in blocks to bound temporary memory."""
+        n = len(codes)
+        scores = np.empty((n, queries.shape[1]), dtype=np.float32)
+        for start in range(0, n, block_rows):
+            block = np.asarray(codes[start:start + block_rows], dtype=np.float32)
+            block_scores = block @ queries
+            if scales is not None:
+                block_scores *= scales[start:start + block_rows, None]
+            scores[start:start + block_rows] = block_scores
+        if deleted:
+            scores[list(deleted)] = -np.inf
+        return scores
+
+    def search(self, query, k: int = 5) -> List[Tuple[str, float]]:
+        """Return (id, cosine similarity) pairs, re-scored with full-precision vectors."""
+        return self.search_batch([query], k=k)[0]
+
+    def search_batch(self, queries, k: int = 5) -> List[List[Tuple[str, float]]]:
+        """Search many queries with a single pass over the codes."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        ids, deleted, codes, scales, full = self._view()
+        count = len(ids) - len(deleted)
+        if count == 0:
+            return [[] for _ in range(len(queries))]
+        scores = self._approximate_scores(codes, scales, deleted, queries.T)
+
+        n_candidates = min(count, max(k, k * self.rescore_factor))
+        results = []
+        for column, query in enumerate(queries):
+            candidates = np.argpartition(-scores[:, column], n_candidates - 1)[:n_candidates]
+            candidates = np.sort(candidates)  # sequential reads from the memory map
+            exact = np.asarray(full[candidates]) @ query
+
+            order = np.argsort(-exact)[:k]
+            results.append([(ids[candidates[i]], float(exact[i])) for i in order])
+        return results
+
+    def search_subset(self, query, ids: Iterable[str], k: int = 5) -> List[Tuple[str, float]]:
+        """Exact search over the given ids only, e.g. the chunks of a few candidate documents."""
+        with self._lock:
+            if self._rows is None:
+                self._rows = {id_: i for i, id_ in enumerate(self.ids) if i not in self.deleted}
+            row_of, all_ids, full = self._rows, self.ids, self._full
+        rows = np.array(sorted(row_of[id_] for id_ in set(ids) if id_ in row_of), dtype=np.int64)
+        if len(rows) == 0:
+            return []
+        # The subset is small, so score it with full-precision vectors directly
+        exact = np.asarray(full[rows]) @ np.asarray(query, dtype=np.float32)
+        order = np.argsort(-exact)[:k]
+        return [(all_ids[rows[i]], float(exact[i])) for i in order]
+
+    def memory_usage(self) -> dict:
+        """Bytes held in RAM versus on disk."""
+        ids, deleted, codes, scales, full = self._view()
+        codes_bytes = 0 if codes is None else codes.nbytes
+        in_ram = not isinstance(codes, np.memmap)
+        return {
+            "mode": self.mode,
+            "vectors": len(ids) - len(deleted),
+            "tombstones": len(deleted),
+            "codes_bytes": codes_bytes,
+            "codes_in_memory": in_ram,
+            "full_precision_bytes_on_disk": 0 if full is None else full.nbytes,
+            "resident_bytes": (codes_bytes if in_ram else 0) + (0 if scales is None else scales.nbytes)
+        }
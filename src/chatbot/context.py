@@ -0,0 +1,248 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from .chunking import get_encoding
+from .vector_store import SearchResult
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+_usage = threading.local()
+
+
+def prompt_tokens_saved() -> int:
+    """Prompt tokens saved so far on the current thread; diff two readings to measure a query."""
+    return getattr(_usage, "saved", 0)
+
+
+class ContextAssembler:
+    """Build a compact, diverse LLM context from search results.
+
+    Adjacent chunks of the same document are merged so their shared overlap
+    appears once, up to ``max_passages`` passages are picked by maximal
+    marginal relevance, and sentences are kept in order of similarity to the
+    query (skipping near-repeats) until ``token_budget`` is spent. Sentences
+    are embedded with the vector store's model; a passage's vector is the
+    normalized mean of its sentence vectors. Sentence and query vectors are
+    kept in an LRU cache of ``cache_size`` entries, so chunks that are
+    retrieved again (and repeated questions) are not re-embedded.
+    """
+
+    def __init__(self, embeddings, token_budget: int = 800, mmr_lambda: float = 0.7,
+                 max_passages: int = 4, redundancy_threshold: float = 0.95,
+                 encoding_name: str = "cl100k_base", cache_size: int = 4096):
+        self.embeddings = embeddings
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.max_passages = max_passages
+        self.redundancy_threshold = redundancy_threshold
+        self.encoding = get_encoding(encoding_name)
+        self.cache_size = cache_size
+        self._vectors: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    @staticmethod
+    def _merge_text(first: str, second: str, max_overlap: int = 4000) -> str:
+        """Concatenate two consecutive chunks, dropping the text they share."""
+        # Find where the start of the second chunk reappears near the end of the first
+        probe = second[:16]
+        if probe:
+            start = max(0, len(first) - max_overlap)
+            index = first.rfind(probe, start)
+            while index != -1:
+                if second.startswith(first[index:]):
+                    return first + second[len(first) - index:]
+                index = first.rfind(probe, start, index + len(probe) - 1)
+        return f"{first}\n{second}"
+
+    def merge_adjacent(self, results: List[SearchResult]) -> List[Dict[str, Any]]:
+        """Group results into passages, merging consecutive chunks of the same document."""
+        groups: Dict[Any, List[Tuple[int, SearchResult]]] = {}
+        for rank, result in enumerate(results):
+            key = result.metadata.get("doc_id", result.source)
+            groups.setdefault(key, []).append((rank, result))
+
+        passages = []
+        for key, members in groups.items():
+            seen_chunks = set()
+            current = None
+            for rank, result in sorted(members, key=lambda item: item[1].metadata.get("chunk_id", -1)):
+                chunk_id = result.metadata.get("chunk_id")
+                if chunk_id is not None and chunk_id in seen_chunks:
+                    continue
+                seen_chunks.add(chunk_id)
+                if (current is not None and chunk_id is not None and key is not None
+                        and current["last_chunk"] == chunk_id - 1):
+                    current["text"] = self._merge_text(current["text"], result.content)
+                    current["last_chunk"] = chunk_id
+                    current["rank"] = min(current["rank"], rank)
+                    current["chunks"] += 1
+                    continue
+                current = {
+                    "text": result.content,
+                    "rank": rank,
+                    "last_chunk": chunk_id,
+                    "chunks": 1,
+                    "label": self._label(result)
+                }
+                passages.append(current)
+        return sorted(passages, key=lambda passage: passage["rank"])
+
+    @staticmethod
+    def _label(result: SearchResult) -> str:
+        parts = []
+        if result.document is not None:
+            parts.append(result.document.file_name)
+        if result.metadata.get("page"):
+            parts.append(f"p. {result.metadata['page']}")
+        return ", ".join(parts)
+
+    @staticmethod
+    def split_sentences(text: str) -> List[str]:
+        return [sentence.strip() for sentence in SENTENCE_SPLIT.split(text) if sentence.strip()]
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    def _cached(self, key) -> Optional[np.ndarray]:
+        with self._cache_lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+            return vector
+
+    def _store(self, key, vector: np.ndarray):
+        with self._cache_lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.cache_size:
+                self._vectors.popitem(last=False)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Normalized sentence vectors; only sentences not in the cache are embedded, in one call."""
+        found = {text: self._cached(("sentence", text)) for text in set(texts)}
+        missing = [text for text, vector in found.items() if vector is None]
+        if missing:
+            for text, vector in zip(missing, self._normalize(self.embeddings.embed_documents(missing))):
+                found[text] = vector
+                self._store(("sentence", text), vector)
+        return np.stack([found[text] for text in texts])
+
+    def _embed_query(self, query: str) -> np.ndarray:
+        vector = self._cached(("query", query))
+        if vector is None:
+            vector = self._normalize(self.embeddings.embed_query(query))
+            self._store(("query", query), vector)
+        return vector
+
+    def _mmr(self, query_vector: np.ndarray, vectors: np.ndarray, k: int) -> List[int]:
+        """Indices of up to ``k`` rows chosen by maximal marginal relevance."""
+        relevance = vectors @ query_vector
+        selected: List[int] = []
+        candidates = list(range(len(vectors)))
+        while candidates and len(selected) < k:
+            if selected:
+                redundancy = (vectors[candidates] @ vectors[selected].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(candidates))
+            scores = self.mmr_lambda * relevance[candidates] - (1 - self.mmr_lambda) * redundancy
+            best = candidates[int(np.argmax(scores))]
+            selected.append(best)
+            candidates.remove(best)
+        return selected
+
+    def assemble(self, query: str, results: List[SearchResult], token_budget: Optional[int] = None,
+                 baseline: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        """Return the context string and token accounting for one prompt.
+
+        ``baseline`` is the text the prompt would otherwise have carried (e.g.
+        the top three chunks); ``tokens_saved`` is measured against it, or
+        against all of ``results`` if it is not given, and is negative when the
+        assembled context is the longer one.
+        """
+        budget = token_budget or self.token_budget
+        if baseline is None:
+            baseline = "\n".join(result.content for result in results)
+        tokens_before = self.count_tokens(baseline)
+        stats = {"chunks_in": len(results), "passages": 0, "sentences_kept": 0,
+                 "tokens_before": tokens_before, "tokens_after": 0, "tokens_saved": 0}
+        if not results:
+            return "", stats
+
+        passages = self.merge_adjacent(results)
+        sentences = []  # (passage index, position, text, tokens)
+        for p_index, passage in enumerate(passages):
+            for position, sentence in enumerate(self.split_sentences(passage["text"])):
+                sentences.append((p_index, position, sentence, self.count_tokens(sentence)))
+        if not sentences:
+            return "", stats
+
+        vectors = self._embed([sentence[2] for sentence in sentences])
+        query_vector = self._embed_query(query)
+
+        owners = np.array([sentence[0] for sentence in sentences])
+        passage_vectors = np.stack([vectors[owners == p].mean(axis=0) for p in range(len(passages))])
+        passage_vectors /= np.maximum(np.linalg.norm(passage_vectors, axis=1, keepdims=True), 1e-9)
+        chosen_passages = self._mmr(query_vector, passage_vectors, self.max_passages)
+
+        # Keep the most query-relevant sentences of the chosen passages that fit the budget
+        allowed = set(chosen_passages)
+        scores = vectors @ query_vector
+        kept: List[int] = []
+        used = 0
+        for index in np.argsort(-scores):
+            p_index, _, _, tokens = sentences[index]
+            if p_index not in allowed or used + tokens > budget:
+                continue
+            if kept and float((vectors[kept] @ vectors[index]).max()) > self.redundancy_threshold:
+                continue
+            kept.append(int(index))
+            used += tokens
+
+        if not kept:
+            # Not even one sentence fits: truncate the most relevant one
+            best = max((i for i, sentence in enumerate(sentences) if sentence[0] in allowed),
+                       key=lambda i: scores[i])
+            truncated = self.encoding.decode(self.encoding.encode(sentences[best][2], disallowed_special=())[:budget])
+            sentences[best] = (sentences[best][0], sentences[best][1], truncated, budget)
+            kept = [best]
+
+        blocks = []
+        kept_set = set(kept)
+        for p_index in chosen_passages:
+            members = [i for i, sentence in enumerate(sentences) if sentence[0] == p_index]
+            parts, gap = [], False
+            for i in members:
+                if i in kept_set:
+                    if gap and parts:
+                        parts.append("...")
+                    parts.append(sentences[i][2])
+                    gap = False
+                else:
+                    gap = True
+            if parts:
+                label = passages[p_index]["label"]
+                header = f"[{len(blocks) + 1}]" + (f" ({label})" if label else "")
+                blocks.append(f"{header} {' '.join(parts)}")
+
+        context = "\n\n".join(blocks)
+        tokens_after = self.count_tokens(context)
+        stats.update({
+            "passages": len(blocks),
+            "sentences_kept": len(kept),
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after
+        })
+        _usage.saved = prompt_tokens_saved() + stats["tokens_saved"]
+        return context, stats
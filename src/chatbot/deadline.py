@@ -0,0 +1,103 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from openai import APITimeoutError
+from config.settings import settings
+
+
+class Deadline:
+    """End-to-end time budget for one query, shared by every stage that serves it.
+
+    Stages ask ``can_afford`` before starting expensive work and call ``cut``
+    when they skip or shorten themselves, so the response can report exactly
+    what was dropped. LLM call latency is tracked as a process-wide moving
+    average to estimate what the remaining budget can pay for. Calls made
+    through ``timed_llm_call`` time out when the budget runs out.
+    """
+
+    _llm_latency = settings.llm_call_estimate_seconds
+    _latency_lock = threading.Lock()
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.budget = seconds
+        self.started = time.monotonic()
+        self.stages_cut: List[str] = []
+
+    @classmethod
+    def observe_llm_latency(cls, seconds: float):
+        with cls._latency_lock:
+            cls._llm_latency = 0.8 * cls._llm_latency + 0.2 * seconds
+
+    @classmethod
+    def llm_latency(cls) -> float:
+        return cls._llm_latency
+
+    @property
+    def bounded(self) -> bool:
+        return self.budget is not None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        if self.budget is None:
+            return float("inf")
+        return max(0.0, self.budget - self.elapsed())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def can_afford(self, llm_calls: float = 1) -> bool:
+        """Whether the remaining budget covers the given number of LLM calls."""
+        return self.remaining() >= llm_calls * self.llm_latency()
+
+    def affordable_llm_calls(self) -> float:
+        return self.remaining() / self.llm_latency()
+
+    def cut(self, stage: str):
+        if stage not in self.stages_cut:
+            self.stages_cut.append(stage)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "budget_s": self.budget,
+            "elapsed_s": round(self.elapsed(), 3),
+            "stages_cut": list(self.stages_cut),
+            "partial": bool(self.stages_cut)
+        }
+
+
+class DeadlineExceeded(Exception):
+    """Raised when an LLM call or a retrieval is cut off by the query's remaining budget."""
+
+
+_llm_calls = threading.local()
+
+
+def llm_calls_made() -> int:
+    """LLM calls made so far on the current thread; diff two readings to count a query's calls."""
+    return getattr(_llm_calls, "count", 0)
+
+
+def timed_llm_call(llm, messages, deadline: Optional[Deadline] = None):
+    """Call the LLM and feed its latency into the deadline estimate.
+
+    With a bounded ``deadline`` the request times out when the remaining
+    budget is spent and ``DeadlineExceeded`` is raised, so the caller can
+    return the partial answer it has instead.
+    """
+    kwargs = {}
+    if deadline is not None and deadline.bounded:
+        if deadline.expired():
+            raise DeadlineExceeded("No time left for an LLM call")
+        kwargs["timeout"] = deadline.remaining()
+    _llm_calls.count = llm_calls_made() + 1
+    start = time.monotonic()
+    try:
+        response = llm(messages, **kwargs)
+    except (APITimeoutError, TimeoutError) as e:
+        if not kwargs:
+            raise
+        raise DeadlineExceeded(f"LLM call timed out after {kwargs['timeout']:.1f}s") from e
+    Deadline.observe_llm_latency(time.monotonic() - start)
+    return response
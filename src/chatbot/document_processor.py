@@ -1,33 +1,40 @@
 import os
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 import PyPDF2
 from docx import Document as DocxDocument
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from config.settings import settings
+from .chunking import StructuredChunker, ChunkDeduplicator, remove_repeated_lines, PAGE_BREAK
+from .document_registry import DocumentRegistry, get_document_registry
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DocumentProcessor:
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
+    def __init__(self, registry: Optional[DocumentRegistry] = None):
+        self.registry = registry or get_document_registry()
+        # Chunk sizes are measured in LLM tokens
+        self.chunker = StructuredChunker(
             chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap,
-            length_function=len,
+            chunk_overlap=settings.chunk_overlap
         )
+        self.last_stats: Dict[str, int] = {}
+        self.stats = {
+            "chunks_created": 0,
+            "exact_duplicates_dropped": 0,
+            "near_duplicates_dropped": 0,
+            "boilerplate_lines_removed": 0
+        }
     
     def load_pdf(self, file_path: str) -> str:
         """Extract text from PDF file."""
         try:
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+                pages = [page.extract_text() or "" for page in pdf_reader.pages]
+                return PAGE_BREAK.join(pages)
         except Exception as e:
             logger.error(f"Error reading PDF {file_path}: {e}")
             return ""
@@ -36,10 +43,18 @@ class DocumentProcessor:
         """Extract text from DOCX file."""
         try:
             doc = DocxDocument(file_path)
-            text = ""
+            lines = []
             for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+                # Mark headings so the chunker can follow the document structure
+                if paragraph.style is not None and paragraph.style.name.startswith("Heading"):
+                    lines.extend(["", f"# {paragraph.text}"])
+                else:
+                    lines.append(paragraph.text)
+            for table in doc.tables:
+                lines.append("")
+                for row in table.rows:
+                    lines.append(" | ".join(cell.text.strip() for cell in row.cells) + " |")
+            return "\n".join(lines) + "\n"
         except Exception as e:
             logger.error(f"Error reading DOCX {file_path}: {e}")
             return ""
@@ -71,23 +86,52 @@ class DocumentProcessor:
             logger.warning(f"No text extracted from {file_path}")
             return []
         
-        # Split text into chunks
-        chunks = self.text_splitter.split_text(text)
+        text, boilerplate_removed = remove_repeated_lines(text)
+        chunks = self.chunker.split(text)
         
-        # Create Document objects with metadata
+        # Per-file attributes live in the document registry; chunks only
+        # carry the integer doc_id and their own position.
+        record = self.registry.register(file_path)
+        
+        # Create Document objects with metadata, dropping duplicate chunks. Dedup is
+        # scoped to this document: a chunk dropped for matching another document would
+        # be lost for good once that document is deleted.
         documents = []
-        for i, chunk in enumerate(chunks):
-            doc = Document(
-                page_content=chunk,
-                metadata={
-                    "source": file_path,
-                    "chunk_id": i,
-                    "file_name": Path(file_path).name,
-                    "file_type": file_extension
-                }
-            )
-            documents.append(doc)
+        dropped = {"exact": 0, "near": 0}
+        deduplicator = ChunkDeduplicator(max_distance=settings.dedup_max_distance)
+        for chunk in chunks:
+            duplicate = deduplicator.check(chunk["text"], file_path) if settings.dedup_chunks else None
+            if duplicate:
+                dropped[duplicate] += 1
+                continue
+            
+            metadata = {
+                "doc_id": record.doc_id,
+                "chunk_id": len(documents),
+                "tokens": chunk["tokens"],
+                "page": chunk["page"]
+            }
+            if chunk["page_end"] != chunk["page"]:
+                metadata["page_end"] = chunk["page_end"]
+            if chunk["section"]:
+                metadata["section"] = chunk["section"]
+            if chunk["has_table"]:
+                metadata["has_table"] = True
+            documents.append(Document(page_content=chunk["text"], metadata=metadata))
         
+        self.last_stats = {
+            "chunks_created": len(documents),
+            "exact_duplicates_dropped": dropped["exact"],
+            "near_duplicates_dropped": dropped["near"],
+            "boilerplate_lines_removed": boilerplate_removed
+        }
+        for key, value in self.last_stats.items():
+            self.stats[key] += value
+        
+        if dropped["exact"] or dropped["near"]:
+            logger.info(
+                f"Dropped {dropped['exact']} exact and {dropped['near']} near-duplicate chunks from {file_path}"
+            )
         logger.info(f"Processed {file_path}: {len(documents)} chunks created")
         return documents
     
@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+from config.settings import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DocumentRecord:
+    """Per-file attributes, stored once and shared by every chunk of the file."""
+    __slots__ = ("doc_id", "source", "file_name", "file_type")
+
+    def __init__(self, doc_id: int, source: str, file_name: str, file_type: str):
+        self.doc_id = doc_id
+        self.source = source
+        self.file_name = file_name
+        self.file_type = file_type
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self):
+        return f"DocumentRecord(doc_id={self.doc_id}, source={self.source!r})"
+
+
+class DocumentRegistry:
+    """SQLite-backed document table; chunks reference rows by integer ``doc_id``."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "doc_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "source TEXT UNIQUE NOT NULL, "
+            "file_name TEXT NOT NULL, "
+            "file_type TEXT NOT NULL)"
+        )
+        self._conn.commit()
+        self._by_id: Dict[int, DocumentRecord] = {}
+        self._by_source: Dict[str, DocumentRecord] = {}
+        self.reload()
+    
+    def reopen(self):
+        """Reconnect to the database file, e.g. after the index directory was swapped for a restore."""
+        with self._lock:
+            self._conn.close()
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._by_id, self._by_source = {}, {}
+        self.reload()
+    
+    def reload(self):
+        """Re-read the table, picking up documents registered by another process."""
+        by_id, by_source = {}, {}
+        for row in self._conn.execute("SELECT doc_id, source, file_name, file_type FROM documents"):
+            record = self._by_id.get(row[0]) or DocumentRecord(*row)
+            by_id[record.doc_id] = record
+            by_source[record.source] = record
+        self._by_id, self._by_source = by_id, by_source
+
+    def _cache(self, record: DocumentRecord):
+        self._by_id[record.doc_id] = record
+        self._by_source[record.source] = record
+
+    def register(self, source: str) -> DocumentRecord:
+        """Return the record for a file, creating it on first sight."""
+        record = self._by_source.get(source)
+        if record is not None:
+            return record
+
+        with self._lock:
+            record = self._by_source.get(source)
+            if record is None:
+                path = Path(source)
+                cursor = self._conn.execute(
+                    "INSERT INTO documents (source, file_name, file_type) VALUES (?, ?, ?)",
+                    (source, path.name, path.suffix.lower())
+                )
+                self._conn.commit()
+                record = DocumentRecord(cursor.lastrowid, source, path.name, path.suffix.lower())
+                self._cache(record)
+        return record
+
+    def get(self, doc_id: int) -> Optional[DocumentRecord]:
+        return self._by_id.get(doc_id)
+
+    def get_by_source(self, source: str) -> Optional[DocumentRecord]:
+        return self._by_source.get(source)
+
+    def resolve(self, metadata: Dict[str, Any]) -> Optional[DocumentRecord]:
+        """Find the document for chunk metadata, including legacy chunks that carry the source path."""
+        if "doc_id" in metadata:
+            return self._by_id.get(metadata["doc_id"])
+        if "source" in metadata:
+            return self._by_source.get(metadata["source"]) or DocumentRecord(
+                -1, metadata["source"], metadata.get("file_name", Path(metadata["source"]).name),
+                metadata.get("file_type", Path(metadata["source"]).suffix.lower())
+            )
+        return None
+
+    def remove(self, source: str) -> Optional[DocumentRecord]:
+        with self._lock:
+            record = self._by_source.pop(source, None)
+            if record is not None:
+                self._by_id.pop(record.doc_id, None)
+                self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (record.doc_id,))
+                self._conn.commit()
+        return record
+
+    def all(self) -> List[DocumentRecord]:
+        return list(self._by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+_registries: Dict[str, DocumentRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_document_registry(db_path: Optional[str] = None) -> DocumentRegistry:
+    """Return the shared registry for a database path (defaults to the Chroma directory)."""
+    db_path = db_path or str(Path(settings.chroma_db_path) / "documents.db")
+    with _registries_lock:
+        if db_path not in _registries:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            _registries[db_path] = DocumentRegistry(db_path)
+        return _registries[db_path]
@@ -0,0 +1,171 @@
+import logging
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from config.settings import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+
+def export_onnx_model(model_name: str, output_dir: str, quantize: bool = False) -> Path:
+    """Export a sentence-transformers model to ONNX, optionally int8-quantized."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    tokenizer.save_pretrained(str(output_path))
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    onnx_path = output_path / ONNX_MODEL_FILE
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+        str(onnx_path),
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"}
+        },
+        opset_version=14
+    )
+    logger.info(f"Exported {model_name} to {onnx_path}")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantized_path = output_path / QUANTIZED_MODEL_FILE
+        quantize_dynamic(str(onnx_path), str(quantized_path), weight_type=QuantType.QInt8)
+        logger.info(f"Quantized model written to {quantized_path}")
+        return quantized_path
+
+    return onnx_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embeddings computed with ONNX Runtime on CPU.
+
+    Reproduces the sentence-transformers pipeline for all-MiniLM-L6-v2 (mean
+    pooling followed by L2 normalization) so vectors stay compatible with
+    collections built by ``HuggingFaceEmbeddings``.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        model_dir: str,
+        quantize: bool = False,
+        batch_size: int = 32,
+        max_length: int = 256,
+        num_threads: Optional[int] = None
+    ):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "The ONNX embedding backend requires onnxruntime and transformers. "
+                "Install them with `pip install onnxruntime transformers`."
+            ) from e
+
+        model_file = QUANTIZED_MODEL_FILE if quantize else ONNX_MODEL_FILE
+        model_path = Path(model_dir) / model_file
+        if not model_path.exists():
+            raise FileNotFoundError(
+                f"ONNX model not found at {model_path}. Export it first with "
+                f"`python -m src.chatbot.embeddings --output-dir {model_dir}"
+                f"{' --quantize' if quantize else ''}`."
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.batch_size = batch_size
+        self.max_length = max_length
+        logger.info(f"Loaded ONNX embedding model from {model_path}")
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np"
+        )
+        inputs = {
+            name: encoded[name].astype(np.int64)
+            for name in ("input_ids", "attention_mask", "token_type_ids")
+            if name in self.input_names and name in encoded
+        }
+        token_embeddings = self.session.run(None, inputs)[0]
+
+        # Mean pooling over non-padding tokens, then L2 normalization
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled = summed / counts
+        norms = np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled / norms
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of documents in batches."""
+        if not texts:
+            return []
+
+        vectors = [
+            self._embed_batch(texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        return np.vstack(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query."""
+        return self._embed_batch([text])[0].tolist()
+
+
+def create_embeddings(backend: Optional[str] = None) -> Embeddings:
+    """Create the embedding function for the configured backend."""
+    backend = (backend or settings.embedding_backend).lower()
+
+    if backend == "onnx":
+        return OnnxEmbeddings(
+            model_name=settings.embedding_model_name,
+            model_dir=settings.onnx_model_dir,
+            quantize=settings.onnx_quantize
+        )
+
+    if backend == "huggingface":
+        from langchain.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=settings.embedding_model_name)
+
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX")
+    parser.add_argument("--model-name", default=settings.embedding_model_name)
+    parser.add_argument("--output-dir", default=settings.onnx_model_dir)
+    parser.add_argument("--quantize", action="store_true", help="Also write an int8-quantized model")
+    args = parser.parse_args()
+
+    export_onnx_model(args.model_name, args.output_dir, quantize=args.quantize)
@@ -1,45 +1,87 @@
 import logging
-from typing import List, Dict, Any, Optional
+import re
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from config.settings import settings
 from .react_agent import ReActAgent
 from .planner import QueryPlanner
-from .vector_store import VectorStore
+from .vector_store import VectorStore, SearchResult
+from .deadline import Deadline, DeadlineExceeded, llm_calls_made, timed_llm_call
+from .context import prompt_tokens_saved
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CONFIDENCE_LINE = re.compile(r"\**Confidence:\s*(\d+(?:\.\d*)?|\.\d+)\s*(%)?[\s.*)]*$", re.IGNORECASE)
+
 class QueryExecutor:
     def __init__(self, vector_store: VectorStore):
         self.vector_store = vector_store
         self.planner = QueryPlanner()
         self.react_agent = ReActAgent(vector_store)
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"queries": 0, "direct": 0, "escalated": 0, "llm_calls": 0, "prompt_tokens_saved": 0}
     
-    def execute_query(self, query: str) -> Dict[str, Any]:
-        """Execute a query using planning and ReAct methodology."""
+    def execute_query(self, query: str, deadline: Optional[Deadline] = None,
+                      retrieved: Optional[List[SearchResult]] = None,
+                      history: Optional[str] = None) -> Dict[str, Any]:
+        """Execute a query within an optional time budget.
+        
+        In ``direct`` mode the query is first answered with one retrieval (or the
+        ``retrieved`` results of a batch search or a session's cached evidence)
+        and one grounded LLM call; it escalates to planning and ReAct only when
+        retrieval scores or the model's self-reported confidence are too low.
+        ``history`` is the condensed conversation a follow-up question refers to.
+        """
+        deadline = deadline or Deadline()
+        calls_before = llm_calls_made()
+        saved_before = prompt_tokens_saved()
+        escalation = None
         try:
-            # Step 1: Plan the query
-            logger.info(f"Planning query: {query}")
-            plan = self.planner.decompose_query(query)
+            if settings.query_mode == "direct":
+                result, escalation = self._execute_direct(query, deadline, retrieved, history)
+                if result is not None:
+                    return self._record(result, calls_before, saved_before)
+                logger.info(f"Escalating query to ReAct: {escalation}")
+            
+            # Step 1: Plan the query, unless the budget only covers answering
+            if deadline.can_afford(3):
+                logger.info(f"Planning query: {query}")
+                plan = self.planner.decompose_query(query, deadline=deadline)
+            else:
+                deadline.cut("planning")
+                plan = self.planner._create_basic_plan(query)
             
             # Step 2: Execute based on complexity
             if plan["complexity_score"] <= 2:
                 # Simple query - use ReAct directly
                 logger.info("Executing simple query with ReAct")
-                result = self.react_agent.process_query(query)
+                react_result = self.react_agent.process_query(query, deadline=deadline, history=history)
                 
-                return {
+                metadata = {
+                    "iterations": react_result["iterations"],
+                    "complexity_score": plan["complexity_score"]
+                }
+                if deadline.bounded:
+                    metadata["deadline"] = deadline.report()
+                if react_result.get("partial"):
+                    metadata["evidence"] = self._evidence_summary(react_result["evidence"])
+                
+                result = {
                     "query": query,
                     "plan": plan,
                     "execution_type": "simple",
-                    "answer": result["answer"],
-                    "metadata": {
-                        "iterations": result["iterations"],
-                        "complexity_score": plan["complexity_score"]
-                    }
+                    "answer": react_result["answer"],
+                    "metadata": metadata
                 }
             else:
                 # Complex query - execute step by step
                 logger.info("Executing complex query with multi-step approach")
-                return self._execute_complex_query(query, plan)
+                result = self._execute_complex_query(query, plan, deadline)
+            
+            if escalation:
+                result["metadata"]["escalation_reason"] = escalation
+            return self._record(result, calls_before, saved_before, escalated=escalation is not None)
                 
         except Exception as e:
             logger.error(f"Error executing query: {e}")
@@ -49,16 +91,131 @@ class QueryExecutor:
                 "error": True
             }
     
-    def _execute_complex_query(self, query: str, plan: Dict[str, Any]) -> Dict[str, Any]:
+    def _execute_direct(self, query: str, deadline: Deadline, retrieved: Optional[List[SearchResult]] = None,
+                        history: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Retrieve once and answer once; returns (result, None) or (None, escalation reason)."""
+        evidence = retrieved
+        if evidence is None:
+            evidence = self.react_agent._search_documents(query, k=settings.direct_top_k, deadline=deadline)
+        if not evidence:
+            return None, "no_results"
+        
+        best_distance = min(result.relevance_score for result in evidence)
+        if best_distance > settings.direct_max_distance:
+            return None, "low_retrieval_score"
+        
+        confidence = None
+        answer = None
+        if deadline.can_afford(1):
+            try:
+                answer, confidence = self._direct_answer(query, evidence, history, deadline)
+            except DeadlineExceeded:
+                logger.warning("Direct answer timed out; returning the evidence")
+            else:
+                # Escalate only if the budget can still pay for the ReAct loop
+                if confidence < settings.direct_min_confidence and deadline.can_afford(2):
+                    return None, "low_confidence"
+        if answer is None:
+            deadline.cut("direct_answer")
+            answer = self.react_agent._partial_answer(evidence)
+        
+        metadata = {
+            "best_distance": round(best_distance, 4),
+            "confidence": confidence,
+            "sources": sorted({result.source for result in evidence if result.source})
+        }
+        if deadline.bounded:
+            metadata["deadline"] = deadline.report()
+        if deadline.stages_cut:
+            metadata["evidence"] = self._evidence_summary(evidence)
+        
+        return {
+            "query": query,
+            "execution_type": "direct",
+            "answer": answer,
+            "metadata": metadata
+        }, None
+    
+    def _direct_answer(self, query: str, evidence: List[SearchResult], history: Optional[str] = None,
+                       deadline: Optional[Deadline] = None) -> Tuple[str, float]:
+        """One grounded answer call; the model reports its own confidence on the last line."""
+        # Without assembly every retrieved chunk went into the prompt
+        baseline = "\n\n".join(f"[{i}] {result.content}" for i, result in enumerate(evidence, 1))
+        context, _ = self.react_agent.context_assembler.assemble(query, evidence, baseline=baseline)
+        conversation = f"\nConversation so far:\n{history}\n" if history else ""
+        prompt = f"""
+Answer the question using only the numbered context passages below.
+If the passages do not contain the answer, say so.
+
+Context:
+{context}
+{conversation}
+Question: {query}
+
+Reply with the answer, then a final line of the form "Confidence: <number between 0 and 1>"
+stating how fully the passages support your answer.
+"""
+        from langchain.schema import HumanMessage
+        response = timed_llm_call(self.react_agent.llm, [HumanMessage(content=prompt)], deadline)
+        return self._parse_confidence(response.content)
+    
+    def _parse_confidence(self, text: str) -> Tuple[str, float]:
+        """Split the answer from its trailing confidence line; a missing score counts as 0.
+
+        Accepts forms such as "0.8", ".8", "0.8." and "80%", clamped to [0, 1].
+        """
+        match = CONFIDENCE_LINE.search(text.strip())
+        if not match:
+            return text.strip(), 0.0
+        confidence = float(match.group(1)) / (100 if match.group(2) else 1)
+        return text.strip()[:match.start()].strip(), min(1.0, max(0.0, confidence))
+    
+    def _record(self, result: Dict[str, Any], calls_before: int, saved_before: int,
+                escalated: bool = False) -> Dict[str, Any]:
+        """Stamp the query's LLM calls and saved prompt tokens into its metadata and update the counters."""
+        llm_calls = llm_calls_made() - calls_before
+        tokens_saved = prompt_tokens_saved() - saved_before
+        result["metadata"]["execution_mode"] = "direct" if result["execution_type"] == "direct" else "react"
+        result["metadata"]["llm_calls"] = llm_calls
+        result["metadata"]["prompt_tokens_saved"] = tokens_saved
+        with self._metrics_lock:
+            self._metrics["queries"] += 1
+            self._metrics["llm_calls"] += llm_calls
+            self._metrics["prompt_tokens_saved"] += tokens_saved
+            if result["execution_type"] == "direct":
+                self._metrics["direct"] += 1
+            if escalated:
+                self._metrics["escalated"] += 1
+        return result
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        queries = metrics["queries"]
+        metrics["direct_ratio"] = round(metrics["direct"] / queries, 3) if queries else 0.0
+        metrics["llm_calls_per_query"] = round(metrics["llm_calls"] / queries, 3) if queries else 0.0
+        metrics["prompt_tokens_saved_per_query"] = round(metrics["prompt_tokens_saved"] / queries, 1) if queries else 0.0
+        return metrics
+    
+    def _execute_complex_query(self, query: str, plan: Dict[str, Any],
+                               deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """Execute complex queries with multiple steps."""
+        deadline = deadline or Deadline()
         sub_answers = []
         all_evidence = []
+        retrieved: List[SearchResult] = []
+        sub_questions = plan.get("sub_questions", [query])
         
         # Execute each sub-question
-        for i, sub_question in enumerate(plan.get("sub_questions", [query])):
+        for i, sub_question in enumerate(sub_questions):
+            # Keep room for at least one reasoning call and the synthesis call
+            if sub_answers and not deadline.can_afford(2):
+                deadline.cut(f"sub_questions:{len(sub_questions) - i}_skipped")
+                break
             logger.info(f"Executing sub-question {i+1}: {sub_question}")
             
-            sub_result = self.react_agent.process_query(sub_question)
+            sub_result = self.react_agent.process_query(sub_question, deadline=deadline)
+            retrieved.extend(sub_result.get("evidence", []))
             sub_answers.append({
                 "question": sub_question,
                 "answer": sub_result["answer"],
@@ -70,7 +227,20 @@ class QueryExecutor:
             all_evidence.extend(evidence)
         
         # Synthesize final answer
-        final_answer = self._synthesize_answers(query, sub_answers, all_evidence)
+        if deadline.can_afford(1):
+            final_answer = self._synthesize_answers(query, sub_answers, all_evidence, deadline)
+        else:
+            deadline.cut("synthesis")
+            final_answer = self._combine_answers(sub_answers)
+        
+        metadata = {
+            "sub_questions_count": len(sub_answers),
+            "complexity_score": plan["complexity_score"]
+        }
+        if deadline.bounded:
+            metadata["deadline"] = deadline.report()
+        if deadline.stages_cut:
+            metadata["evidence"] = self._evidence_summary(retrieved)
         
         return {
             "query": query,
@@ -79,12 +249,32 @@ class QueryExecutor:
             "sub_answers": sub_answers,
             "answer": final_answer,
             "evidence": all_evidence,
-            "metadata": {
-                "sub_questions_count": len(sub_answers),
-                "complexity_score": plan["complexity_score"]
-            }
+            "metadata": metadata
         }
     
+    def _evidence_summary(self, evidence: List[SearchResult], limit: int = 5) -> List[Dict[str, Any]]:
+        """Compact, de-duplicated evidence returned alongside partial answers."""
+        summary, seen = [], set()
+        for result in sorted(evidence, key=lambda r: r.relevance_score):
+            if result.content in seen:
+                continue
+            seen.add(result.content)
+            summary.append({
+                "source": result.source,
+                "content": result.content[:300],
+                "relevance_score": result.relevance_score
+            })
+            if len(summary) == limit:
+                break
+        return summary
+    
+    def _combine_answers(self, sub_answers: List[Dict]) -> str:
+        """Join sub-answers without an LLM call."""
+        combined = f"Based on the analysis:\n\n"
+        for i, sub_answer in enumerate(sub_answers, 1):
+            combined += f"{i}. {sub_answer['answer']}\n\n"
+        return combined
+    
     def _extract_evidence(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Extract evidence/sources from ReAct result."""
         evidence = []
@@ -104,7 +294,8 @@ class QueryExecutor:
         
         return evidence
     
-    def _synthesize_answers(self, original_query: str, sub_answers: List[Dict], evidence: List[Dict]) -> str:
+    def _synthesize_answers(self, original_query: str, sub_answers: List[Dict], evidence: List[Dict],
+                            deadline: Optional[Deadline] = None) -> str:
         """Synthesize final answer from sub-answers and evidence."""
         try:
             synthesis_prompt = f"""
@@ -120,15 +311,14 @@ Sub-questions and Answers:
             synthesis_prompt += "\nPlease provide a well-structured, comprehensive answer that integrates the information from all sub-answers:"
             
             from langchain.schema import HumanMessage
-            response = self.react_agent.llm([HumanMessage(content=synthesis_prompt)])
+            response = timed_llm_call(self.react_agent.llm, [HumanMessage(content=synthesis_prompt)], deadline)
             
             return response.content
             
+        except DeadlineExceeded:
+            deadline.cut("synthesis")
+            return self._combine_answers(sub_answers)
         except Exception as e:
             logger.error(f"Error synthesizing answers: {e}")
             # Fallback: combine sub-answers
-            combined = f"Based on the analysis:\n\n"
-            for i, sub_answer in enumerate(sub_answers, 1):
-                combined += f"{i}. {sub_answer['answer']}\n\n"
-            
-            return combined
\ No newline at end of file
+            return self._combine_answers(sub_answers)
\ No newline at end of file
@@ -0,0 +1,70 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Any
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class IndexVersion:
+    """Version marker shared by the writer and read-only workers through the data directory.
+
+    The writer bumps the version after every committed ingest; readers poll
+    the marker (a cheap ``stat``, throttled to ``poll_interval`` seconds) and
+    reopen their index when it changes.
+    """
+
+    def __init__(self, directory: str, poll_interval: float = 1.0):
+        self.path = Path(directory) / "index_version.json"
+        self.poll_interval = poll_interval
+        self._seen_version = self.read().get("version", 0)
+        self._seen_mtime = self._mtime()
+        self._last_poll = time.monotonic()
+
+    def _mtime(self) -> float:
+        try:
+            return self.path.stat().st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def read(self) -> Dict[str, Any]:
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"version": 0}
+
+    @property
+    def version(self) -> int:
+        return self._seen_version
+
+    def bump(self, **info) -> int:
+        """Publish a new version atomically (writer only)."""
+        version = self.read().get("version", 0) + 1
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"version": version, "updated_at": time.time(), **info}))
+        tmp.replace(self.path)
+        self._seen_version = version
+        self._seen_mtime = self._mtime()
+        return version
+
+    def changed(self) -> bool:
+        """Whether a newer version has been published since the last call that returned True."""
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return False
+        self._last_poll = now
+
+        mtime = self._mtime()
+        if mtime == self._seen_mtime:
+            return False
+        self._seen_mtime = mtime
+        version = self.read().get("version", 0)
+        if version == self._seen_version:
+            return False
+        logger.info(f"Index version changed: {self._seen_version} -> {version}")
+        self._seen_version = version
+        return True
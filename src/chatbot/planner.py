@@ -1,8 +1,9 @@
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 from config.settings import settings
+from .deadline import Deadline, DeadlineExceeded, timed_llm_call
 import json
 
 logging.basicConfig(level=logging.INFO)
@@ -16,8 +17,8 @@ class QueryPlanner:
             model_name="gpt-3.5-turbo"
         )
     
-    def decompose_query(self, query: str) -> Dict[str, Any]:
-        """Break down complex query into sub-questions and plan."""
+    def decompose_query(self, query: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """Break down complex query into sub-questions and plan; a basic plan if the deadline cuts it off."""
         system_prompt = """
 You are a query planning assistant. Your job is to analyze user questions and break them down into actionable steps.
 
@@ -49,10 +50,10 @@ Please provide a detailed breakdown following the JSON format specified.
 """
         
         try:
-            response = self.llm([
+            response = timed_llm_call(self.llm, [
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=user_prompt)
-            ])
+            ], deadline)
             
             # Try to parse JSON response
             try:
@@ -64,6 +65,9 @@ Please provide a detailed breakdown following the JSON format specified.
                 logger.warning("Failed to parse JSON plan, creating basic plan")
                 return self._create_basic_plan(query)
                 
+        except DeadlineExceeded:
+            deadline.cut("planning")
+            return self._create_basic_plan(query)
         except Exception as e:
             logger.error(f"Error in query planning: {e}")
             return self._create_basic_plan(query)
@@ -1,4 +1,5 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from typing import List, Dict, Any, Optional
 import re
 import json
@@ -7,10 +8,16 @@ from langchain.llms import OpenAI
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import HumanMessage, AIMessage, SystemMessage
 from config.settings import settings
+from .vector_store import SearchResult
+from .deadline import Deadline, DeadlineExceeded, timed_llm_call
+from .context import ContextAssembler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Searches under a deadline run here so the caller can stop waiting when the budget is spent
+_retrieval_pool = ThreadPoolExecutor(max_workers=settings.max_in_flight_queries, thread_name_prefix="retrieval")
+
 class ReActAgent:
     def __init__(self, vector_store):
         self.vector_store = vector_store
@@ -20,29 +27,56 @@ class ReActAgent:
             model_name="gpt-3.5-turbo"
         )
         self.max_iterations = 5
+        self.context_assembler = ContextAssembler(
+            vector_store.embeddings,
+            token_budget=settings.context_token_budget,
+            mmr_lambda=settings.mmr_lambda,
+            max_passages=settings.context_max_passages
+        )
         self.tools = {
             "search_documents": self._search_documents,
             "summarize_content": self._summarize_content,
             "answer_question": self._answer_question
         }
     
-    def _search_documents(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Search for relevant documents."""
+    def _search_documents(self, query: str, k: int = 5, deadline: Optional[Deadline] = None) -> List[SearchResult]:
+        """Search for relevant documents, giving up with no results once a bounded deadline is spent."""
         try:
-            results = self.vector_store.similarity_search_with_score(query, k=k)
-            documents = []
-            for doc, score in results:
-                documents.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "relevance_score": float(score)
-                })
-            return documents
+            if deadline is None or not deadline.bounded:
+                return self.vector_store.search(query, k=k)
+            future = _retrieval_pool.submit(self.vector_store.search, query, k=k)
+            try:
+                return future.result(timeout=deadline.remaining())
+            except FutureTimeout:
+                logger.warning(f"Search timed out for query: {query}")
+                deadline.cut("retrieval")
+                return []
         except Exception as e:
             logger.error(f"Error in search_documents: {e}")
             return []
     
-    def _summarize_content(self, content: str) -> str:
+    def _summary_label(self, entry: Dict[str, Any]) -> str:
+        record = self.vector_store.registry.get(entry["doc_id"])
+        label = record.file_name if record is not None else f"document {entry['doc_id']}"
+        if entry.get("level") == "section" and entry.get("section"):
+            label = f"{label}, section {entry['section']}"
+        return label
+    
+    def _summary_references(self, results: List[SearchResult]) -> str:
+        """Ids of the stored summaries covering the results, for the agent to cite in summarize_content."""
+        summary_references = getattr(self.vector_store, "summary_references", None)
+        entries = summary_references(results) if summary_references is not None else []
+        return ", ".join(f"{entry['id']} ({self._summary_label(entry)})" for entry in entries)
+    
+    def _stored_summary(self, content: str) -> Optional[str]:
+        """Reuse a summary generated at ingest time when the input cites its id."""
+        find_summary = getattr(self.vector_store, "find_summary", None)
+        match = find_summary(content) if find_summary is not None else None
+        if match is None:
+            return None
+        return f"Stored summary of {self._summary_label(match)}: {match['summary']}"
+    
+    def _summarize_content(self, content: str, deadline: Optional[Deadline] = None) -> str:
         """Summarize given content."""
         try:
             prompt = f"""
@@ -52,13 +86,16 @@ class ReActAgent:
             
             Summary:
             """
-            response = self.llm([HumanMessage(content=prompt)])
+            response = timed_llm_call(self.llm, [HumanMessage(content=prompt)], deadline)
             return response.content
+        except DeadlineExceeded:
+            deadline.cut("summarize_content")
+            return content[:500]
         except Exception as e:
             logger.error(f"Error in summarize_content: {e}")
             return "Error generating summary"
     
-    def _answer_question(self, question: str, context: str) -> str:
+    def _answer_question(self, question: str, context: str, deadline: Optional[Deadline] = None) -> str:
         """Answer question based on provided context."""
         try:
             prompt = f"""
@@ -71,8 +108,11 @@ class ReActAgent:
             
             Answer:
             """
-            response = self.llm([HumanMessage(content=prompt)])
+            response = timed_llm_call(self.llm, [HumanMessage(content=prompt)], deadline)
             return response.content
+        except DeadlineExceeded:
+            deadline.cut("answer_question")
+            return f"Relevant context:\n{context}"
         except Exception as e:
             logger.error(f"Error in answer_question: {e}")
             return "Error generating answer"
@@ -92,37 +132,83 @@ class ReActAgent:
         
         return None
     
-    def _execute_action(self, action: str, action_input: str) -> str:
-        """Execute the specified action."""
+    def _execute_action(self, action: str, action_input: str, evidence: Optional[List[SearchResult]] = None,
+                        deadline: Optional[Deadline] = None) -> str:
+        """Execute the specified action, collecting retrieved chunks into ``evidence``."""
+        deadline = deadline or Deadline()
         if action == "search_documents":
-            results = self._search_documents(action_input)
+            results = self._search_documents(action_input, k=settings.context_candidates, deadline=deadline)
+            if evidence is not None:
+                evidence.extend(results)
             if results:
-                return f"Found {len(results)} relevant documents:\n" + \
-                       "\n".join([f"- {doc['content'][:200]}..." for doc in results[:3]])
+                # Measured against the observation this used to be: three 200-character snippets
+                baseline = f"Found {len(results)} relevant documents:\n" + "\n".join(
+                    f"- {result.content[:200]}..." for result in results[:3]
+                )
+                context, stats = self.context_assembler.assemble(
+                    action_input, results, token_budget=settings.observation_token_budget, baseline=baseline
+                )
+                observation = f"Found {stats['passages']} relevant passages:\n{context}"
+                references = self._summary_references(results)
+                if references:
+                    observation += f"\nStored summaries: {references}"
+                return observation
             else:
                 return "No relevant documents found."
         
         elif action == "summarize_content":
-            return self._summarize_content(action_input)
+            stored = self._stored_summary(action_input)
+            if stored is not None:
+                return stored
+            if not deadline.can_afford(2):
+                deadline.cut("summarize_content")
+                return action_input[:500]
+            return self._summarize_content(action_input, deadline)
         
         elif action == "answer_question":
             # For this action, we need both question and context
-            # We'll use recent search results as context
-            recent_search = self._search_documents(action_input, k=3)
-            context = "\n".join([doc['content'] for doc in recent_search])
-            return self._answer_question(action_input, context)
+            # Retrieve candidates and compress them into a diverse, budgeted context
+            recent_search = self._search_documents(action_input, k=settings.context_candidates, deadline=deadline)
+            if evidence is not None:
+                evidence.extend(recent_search)
+            context, _ = self.context_assembler.assemble(
+                action_input, recent_search,
+                baseline="\n".join(result.content for result in recent_search[:3])
+            )
+            if not deadline.can_afford(1):
+                deadline.cut("answer_question")
+                return f"Relevant context:\n{context}"
+            return self._answer_question(action_input, context, deadline)
         
         else:
             return f"Unknown action: {action}"
     
-    def process_query(self, query: str) -> Dict[str, Any]:
-        """Process query using ReAct methodology."""
+    def _partial_answer(self, evidence: List[SearchResult]) -> str:
+        """Best answer available without another LLM call: the most relevant evidence found so far."""
+        if not evidence:
+            return "The time budget ran out before any relevant information was found."
+        
+        seen, lines = set(), []
+        for result in sorted(evidence, key=lambda r: r.relevance_score):
+            if result.content in seen:
+                continue
+            seen.add(result.content)
+            source = f" ({result.document.file_name})" if result.document else ""
+            lines.append(f"- {result.content[:300].strip()}...{source}")
+            if len(lines) == 3:
+                break
+        return "The time budget ran out before a complete answer. Most relevant evidence found:\n" + "\n".join(lines)
+    
+    def process_query(self, query: str, deadline: Optional[Deadline] = None,
+                      history: Optional[str] = None) -> Dict[str, Any]:
+        """Process query using ReAct methodology, optionally following up on a conversation."""
+        deadline = deadline or Deadline()
         system_prompt = """
 You are a helpful AI assistant that answers questions based on document content using the ReAct methodology.
 
 Available tools:
 - search_documents: Search for relevant documents (input: search query)
-- summarize_content: Summarize given content (input: content to summarize)
+- summarize_content: Summarize given content (input: content to summarize, or a stored summary id such as 3:document)
 - answer_question: Answer a question based on context (input: question)
 
 For each step, follow this format:
@@ -136,14 +222,33 @@ When you have enough information, provide your final answer starting with "Final
 """
         
         conversation_history = [SystemMessage(content=system_prompt)]
-        conversation_history.append(HumanMessage(content=f"Question: {query}"))
+        conversation = f"Conversation so far:\n{history}\n\n" if history else ""
+        conversation_history.append(HumanMessage(content=f"{conversation}Question: {query}"))
         
+        evidence: List[SearchResult] = []
         iteration = 0
+        # Lower the iteration cap to what the time budget can pay for
+        max_iterations = self.max_iterations
+        if deadline.bounded:
+            max_iterations = min(max_iterations, int(deadline.affordable_llm_calls()))
+            if max_iterations < self.max_iterations:
+                deadline.cut("react_iterations")
+        
+        if max_iterations == 0:
+            # Not even one reasoning step fits: retrieve directly and return the evidence
+            evidence.extend(self._search_documents(query, deadline=deadline))
+            return {
+                "answer": self._partial_answer(evidence),
+                "iterations": 0,
+                "conversation": conversation_history,
+                "evidence": evidence,
+                "partial": True
+            }
         
-        while iteration < self.max_iterations:
+        while iteration < max_iterations:
             try:
                 # Get agent's response
-                response = self.llm(conversation_history)
+                response = timed_llm_call(self.llm, conversation_history, deadline)
                 agent_response = response.content
                 
                 logger.info(f"Agent response (iteration {iteration}): {agent_response}")
@@ -154,7 +259,8 @@ When you have enough information, provide your final answer starting with "Final
                     return {
                         "answer": final_answer,
                         "iterations": iteration + 1,
-                        "conversation": conversation_history
+                        "conversation": conversation_history,
+                        "evidence": evidence
                     }
                 
                 # Parse and execute action
@@ -164,7 +270,7 @@ When you have enough information, provide your final answer starting with "Final
                     action_input = action_info["action_input"]
                     
                     # Execute action
-                    observation = self._execute_action(action, action_input)
+                    observation = self._execute_action(action, action_input, evidence, deadline)
                     
                     # Add observation to conversation
                     conversation_history.append(AIMessage(content=agent_response))
@@ -174,21 +280,41 @@ When you have enough information, provide your final answer starting with "Final
                     return {
                         "answer": agent_response,
                         "iterations": iteration + 1,
-                        "conversation": conversation_history
+                        "conversation": conversation_history,
+                        "evidence": evidence
                     }
                 
                 iteration += 1
                 
+                if deadline.bounded and not deadline.can_afford(1):
+                    deadline.cut("react_iterations")
+                    break
+                
+            except DeadlineExceeded:
+                # The reasoning call ran out of time: answer with the evidence found so far
+                deadline.cut("react_iterations")
+                break
             except Exception as e:
                 logger.error(f"Error in ReAct processing: {e}")
                 return {
                     "answer": f"Error processing query: {str(e)}",
                     "iterations": iteration,
-                    "conversation": conversation_history
+                    "conversation": conversation_history,
+                    "evidence": evidence
                 }
         
+        if deadline.bounded and iteration < self.max_iterations:
+            return {
+                "answer": self._partial_answer(evidence),
+                "iterations": iteration,
+                "conversation": conversation_history,
+                "evidence": evidence,
+                "partial": True
+            }
+        
         return {
             "answer": "Maximum iterations reached. Unable to provide a complete answer.",
             "iterations": iteration,
-            "conversation": conversation_history
-        }
\ No newline at end of file
+            "conversation": conversation_history,
+            "evidence": evidence
+        }
@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRIORITIES: Tuple[str, ...] = ("interactive", "batch")
+
+
+class QueryRejected(Exception):
+    """Raised when a query is shed because the queue is full or the wait would be too long."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueryScheduler:
+    """Admission control and priority queueing in front of the query engine.
+
+    At most ``max_in_flight`` queries execute at once (in the default thread
+    pool); the rest wait in per-priority FIFO queues, and a free slot always
+    goes to the highest-priority waiter. A query is rejected up front when
+    the queue is full or when its estimated wait (queries ahead of it times
+    the moving-average service time, divided by the slots) exceeds
+    ``max_queue_wait``. Queries that start before ``is_ready`` reports the
+    engine warm are left out of the service-time average, so a cold start
+    does not inflate it. All state is touched only from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue_size: int,
+        max_queue_wait: float,
+        initial_service_time: float = 5.0,
+        priorities: Tuple[str, ...] = PRIORITIES,
+        is_ready: Optional[Callable[[], bool]] = None
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue_size = max_queue_size
+        self.max_queue_wait = max_queue_wait
+        self.priorities = priorities
+        self.service_time = initial_service_time
+        self.is_ready = is_ready or (lambda: True)
+        self._queues: Dict[str, deque] = {priority: deque() for priority in priorities}
+        self._in_flight = 0
+        self._wait_times: deque = deque(maxlen=1000)
+        self._counters = {"admitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def estimate_wait(self, priority: str) -> float:
+        """Expected queueing delay for a new query of the given priority."""
+        rank = self.priorities.index(priority)
+        ahead = sum(len(self._queues[p]) for p in self.priorities[:rank + 1])
+        if self._in_flight < self.max_in_flight and ahead == 0:
+            return 0.0
+        return (ahead + 1) * self.service_time / self.max_in_flight
+
+    def _admit(self, priority: str) -> float:
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}. Expected one of {self.priorities}")
+
+        estimated_wait = self.estimate_wait(priority)
+        retry_after = max(1, math.ceil(self.service_time))
+        if self.queued >= self.max_queue_size:
+            self._counters["rejected"] += 1
+            raise QueryRejected("Query queue is full", retry_after)
+        if estimated_wait > self.max_queue_wait:
+            self._counters["rejected"] += 1
+            raise QueryRejected(
+                f"Estimated queue wait {estimated_wait:.1f}s exceeds {self.max_queue_wait:.1f}s",
+                max(retry_after, math.ceil(estimated_wait - self.max_queue_wait))
+            )
+        self._counters["admitted"] += 1
+        return estimated_wait
+
+    async def _acquire(self, priority: str):
+        if self._in_flight < self.max_in_flight and self.queued == 0:
+            self._in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._queues[priority]:
+                self._queues[priority].remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # The slot was handed to us just before cancellation; pass it on
+                self._release()
+            raise
+
+    def _release(self):
+        for priority in self.priorities:
+            queue = self._queues[priority]
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    # Hand the slot over directly; in_flight stays the same
+                    waiter.set_result(None)
+                    return
+        self._in_flight -= 1
+
+    async def run(self, func: Callable, *args, priority: str = "interactive", **kwargs) -> Any:
+        """Run ``func`` in the thread pool once admitted; raises QueryRejected when shed."""
+        self._admit(priority)
+        enqueued = time.monotonic()
+        await self._acquire(priority)
+        self._wait_times.append(time.monotonic() - enqueued)
+
+        started = time.monotonic()
+        # A query that starts cold also waits for models to load and documents to index
+        warm = self.is_ready()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(func, *args, **kwargs)
+            )
+            self._counters["completed"] += 1
+            return result
+        except Exception:
+            self._counters["failed"] += 1
+            raise
+        finally:
+            # Exponential moving average of warm service time drives the wait estimate
+            if warm:
+                self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started)
+            self._release()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        waits = sorted(self._wait_times)
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": {priority: len(queue) for priority, queue in self._queues.items()},
+            "avg_service_time_s": round(self.service_time, 3),
+            "queue_wait_s": {
+                "avg": round(sum(waits) / len(waits), 4) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95)], 4) if waits else 0.0,
+                "max": round(waits[-1], 4) if waits else 0.0
+            },
+            **self._counters
+        }
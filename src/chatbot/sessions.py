@@ -0,0 +1,259 @@
+import base64
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import numpy as np
+from config.settings import settings
+from .vector_store import SearchResult
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Server-side state of one conversation: condensed turns and recently retrieved evidence.
+
+    Each retrieval is kept with the vector of the query that produced it and
+    the index version it was retrieved from, so a follow-up whose query lands
+    close to an earlier one can reuse the chunks instead of searching again,
+    as long as the index has not changed since. Both histories are bounded.
+    """
+
+    def __init__(self, session_id: str, max_turns: int = 20, max_retrievals: int = 4,
+                 answer_chars: int = 300):
+        self.session_id = session_id
+        self.created_at = time.time()
+        self.last_active = time.time()
+        self.answer_chars = answer_chars
+        self.turns: deque = deque(maxlen=max_turns)
+        self.retrievals: deque = deque(maxlen=max_retrievals)
+
+    @property
+    def is_follow_up(self) -> bool:
+        return bool(self.turns)
+
+    def add_turn(self, question: str, answer: str):
+        # Answers are condensed to their opening so the history stays small in storage and prompts
+        condensed = answer if len(answer) <= self.answer_chars else answer[:self.answer_chars].rsplit(" ", 1)[0] + "..."
+        self.turns.append((question, condensed))
+
+    def last_question(self) -> str:
+        return self.turns[-1][0] if self.turns else ""
+
+    def history_text(self, turns: int) -> str:
+        """The last ``turns`` exchanges as prompt text."""
+        recent = list(self.turns)[-turns:] if turns > 0 else []
+        return "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in recent)
+
+    def remember_evidence(self, query_vector, results: List[SearchResult], index_version: int = 0):
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-9)
+        self.retrievals.append((vector, results, index_version))
+
+    def cached_evidence(self, query_vector, min_similarity: float,
+                        index_version: int = 0) -> Optional[List[SearchResult]]:
+        """Results of the earlier retrieval whose query is most similar, if similar enough.
+
+        Retrievals from another index version are dropped: their chunks may
+        have been deleted or replaced since.
+        """
+        current = [retrieval for retrieval in self.retrievals if retrieval[2] == index_version]
+        if len(current) != len(self.retrievals):
+            self.retrievals = deque(current, maxlen=self.retrievals.maxlen)
+        if not current:
+            return None
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector /= max(float(np.linalg.norm(vector)), 1e-9)
+        similarity, results = max(((float(past @ vector), results) for past, results, _ in current),
+                                  key=lambda item: item[0])
+        return results if similarity >= min_similarity else None
+
+    def to_state(self) -> Dict[str, Any]:
+        """JSON-serializable turns and retrievals, for the session store."""
+        return {
+            "turns": list(self.turns),
+            "retrievals": [
+                {
+                    "vector": base64.b64encode(vector.tobytes()).decode(),
+                    "index_version": index_version,
+                    "results": [[result.content, result.metadata, result.relevance_score] for result in results]
+                }
+                for vector, results, index_version in self.retrievals
+            ]
+        }
+
+    def load_state(self, state: Dict[str, Any], resolve: Callable[[Dict[str, Any]], Any]):
+        """Restore ``to_state`` output; retrievals citing a document that no longer exists are dropped."""
+        self.turns.extend(tuple(turn) for turn in state.get("turns", []))
+        for retrieval in state.get("retrievals", []):
+            results = []
+            for content, metadata, score in retrieval["results"]:
+                document = resolve(metadata)
+                if document is None and "doc_id" in metadata:
+                    break
+                results.append(SearchResult(content, metadata, score, document))
+            else:
+                vector = np.frombuffer(base64.b64decode(retrieval["vector"]), dtype=np.float32).copy()
+                self.retrievals.append((vector, results, retrieval["index_version"]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "idle_s": round(time.time() - self.last_active, 3),
+            "turns": [{"question": question, "answer": answer} for question, answer in self.turns],
+            "cached_retrievals": len(self.retrievals)
+        }
+
+
+class SessionStore:
+    """Conversation sessions in SQLite, shared by every worker process.
+
+    A turn loads its session from ``db_path`` and writes it back when it
+    completes (``open``), so any worker can serve any turn of a conversation.
+    Turns of one session are serialized within a process; across workers the
+    last turn to finish wins. Idle sessions expire and, beyond
+    ``max_sessions``, the least recently active ones are evicted. The counters
+    in ``get_metrics`` are per process.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_sessions: int = 1000, idle_seconds: float = 1800.0,
+                 max_turns: int = 20, max_retrievals: int = 4,
+                 resolve: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_turns = max_turns
+        self.max_retrievals = max_retrievals
+        self.resolve = resolve or (lambda metadata: None)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # Per-session turn locks, striped so their number stays bounded
+        self._turn_locks = [threading.Lock() for _ in range(64)]
+        self._metrics = {
+            "created": 0,
+            "expired": 0,
+            "evicted": 0,
+            "follow_ups": 0,
+            "searches_avoided": 0
+        }
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so that constructing the store stays cheap
+        if self._conn is None:
+            db_path = self.db_path or settings.session_db_path
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, "
+                "created_at REAL NOT NULL, "
+                "last_active REAL NOT NULL, "
+                "state TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _expire(self, conn: sqlite3.Connection, now: float):
+        cursor = conn.execute("DELETE FROM sessions WHERE last_active < ?", (now - self.idle_seconds,))
+        self._metrics["expired"] += max(cursor.rowcount, 0)
+
+    def _evict(self, conn: sqlite3.Connection):
+        excess = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+        if excess > 0:
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE session_id IN "
+                "(SELECT session_id FROM sessions ORDER BY last_active LIMIT ?)", (excess,)
+            )
+            self._metrics["evicted"] += max(cursor.rowcount, 0)
+
+    def _new_session(self, session_id: str) -> Session:
+        return Session(session_id, self.max_turns, self.max_retrievals)
+
+    def get(self, session_id: Optional[str] = None, create: bool = True) -> Optional[Session]:
+        """Load the session and mark it active; creates it (with a fresh id if none is given)."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            self._expire(conn, now)
+            row = None
+            if session_id:
+                row = conn.execute("SELECT created_at, state FROM sessions WHERE session_id = ?",
+                                   (session_id,)).fetchone()
+            if row is None:
+                if not create:
+                    conn.commit()
+                    return None
+                session = self._new_session(session_id or uuid.uuid4().hex)
+                conn.execute("INSERT INTO sessions (session_id, created_at, last_active, state) VALUES (?, ?, ?, ?)",
+                             (session.session_id, session.created_at, now, json.dumps(session.to_state())))
+                self._metrics["created"] += 1
+                self._evict(conn)
+            else:
+                session = self._new_session(session_id)
+                session.created_at = row[0]
+                session.load_state(json.loads(row[1]), self.resolve)
+                conn.execute("UPDATE sessions SET last_active = ? WHERE session_id = ?", (now, session_id))
+            conn.commit()
+        session.last_active = now
+        return session
+
+    def save(self, session: Session):
+        """Write a session back; a session ended meanwhile stays ended."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE sessions SET last_active = ?, state = ? WHERE session_id = ?",
+                         (time.time(), json.dumps(session.to_state()), session.session_id))
+            conn.commit()
+
+    @contextmanager
+    def open(self, session_id: Optional[str] = None) -> Iterator[Session]:
+        """Load (or create) a session for one turn and save it when the turn completes."""
+        session_id = session_id or uuid.uuid4().hex
+        # One question at a time per conversation keeps its history in order
+        with self._turn_locks[zlib.crc32(session_id.encode()) % len(self._turn_locks)]:
+            session = self.get(session_id)
+            yield session
+            self.save(session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            conn = self._connection()
+            deleted = conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount
+            conn.commit()
+        return deleted > 0
+
+    def record_query(self, follow_up: bool, search_avoided: bool):
+        with self._lock:
+            if follow_up:
+                self._metrics["follow_ups"] += 1
+            if search_avoided:
+                self._metrics["searches_avoided"] += 1
+
+    def __len__(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connection()
+            self._expire(conn, time.time())
+            conn.commit()
+            active = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            metrics = {"active": active, **self._metrics}
+        follow_ups = metrics["follow_ups"]
+        metrics["searches_avoided_per_follow_up"] = (
+            round(metrics["searches_avoided"] / follow_ups, 3) if follow_ups else 0.0
+        )
+        return metrics
@@ -0,0 +1,300 @@
+"""Portable index snapshots: create, verify, restore and roll back.
+
+A snapshot is a directory holding a verbatim copy of the live index
+directory (Chroma's SQLite database and HNSW segment files, the document
+registry, the memory-mappable compressed vector arrays and the ingestion
+state) plus a ``manifest.json`` with the format version, the embedding
+configuration and the size and SHA-256 of every file. A restored process
+opens these files in place, so restoring costs a file copy and a checksum
+pass rather than re-parsing and re-embedding the corpus.
+
+The live index path (``CHROMA_DB_PATH``) is a symlink into a sibling
+``<name>.versions`` directory. Restore copies a verified snapshot into a
+new version directory and swaps the symlink in one atomic rename; the
+previous versions are kept for ``rollback``. Running processes notice the
+swap through the index version marker and reopen the index.
+
+Usage:
+    python -m src.chatbot.snapshot create [--name NAME]
+    python -m src.chatbot.snapshot list
+    python -m src.chatbot.snapshot verify NAME
+    python -m src.chatbot.snapshot restore NAME
+    python -m src.chatbot.snapshot rollback
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from config.settings import settings
+from .index_version import IndexVersion
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "docqa-index-snapshot"
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+SQLITE_SUFFIXES = {".sqlite3", ".db"}
+# Files that describe the running process rather than the index content
+EXCLUDED_FILES = {"index_version.json"}
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is missing, corrupt or incompatible with this deployment."""
+
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _copy_file(source: Path, target: Path):
+    """Copy one file; SQLite databases go through the backup API for a consistent copy."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if source.suffix in SQLITE_SUFFIXES:
+        source_conn = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        target_conn = sqlite3.connect(target)
+        try:
+            source_conn.backup(target_conn)
+        finally:
+            target_conn.close()
+            source_conn.close()
+    else:
+        shutil.copy2(source, target)
+
+
+def _index_files(directory: Path) -> List[Path]:
+    return sorted(
+        path for path in directory.rglob('*')
+        if path.is_file() and path.name not in EXCLUDED_FILES
+        and not path.name.endswith(("-wal", "-shm", "-journal", ".tmp"))
+    )
+
+
+class SnapshotManager:
+    """Snapshots of the index directory and atomic version swaps of the live path."""
+
+    def __init__(self, live_path: Optional[str] = None, snapshot_dir: Optional[str] = None,
+                 keep_versions: Optional[int] = None):
+        self.live_path = Path(live_path or settings.chroma_db_path)
+        self.snapshot_dir = Path(snapshot_dir or settings.snapshot_dir)
+        self.versions_dir = self.live_path.parent / f"{self.live_path.name}.versions"
+        self.keep_versions = keep_versions if keep_versions is not None else settings.snapshot_keep_versions
+
+    def _embedding_config(self) -> Dict[str, Any]:
+        return {
+            "embedding_backend": settings.embedding_backend,
+            "embedding_model_name": settings.embedding_model_name,
+            "vector_compression": settings.vector_compression
+        }
+
+    def create(self, name: Optional[str] = None, attempts: int = 3) -> Dict[str, Any]:
+        """Copy the live index into a new snapshot; retried if an ingest commits mid-copy."""
+        name = name or time.strftime("%Y%m%d-%H%M%S")
+        target = self.snapshot_dir / name
+        if target.exists():
+            raise SnapshotError(f"Snapshot {name} already exists")
+        if not self.live_path.exists():
+            raise SnapshotError(f"No index at {self.live_path}")
+
+        marker = IndexVersion(str(self.live_path))
+        staging = self.snapshot_dir / f".{name}.tmp"
+        for _ in range(attempts):
+            shutil.rmtree(staging, ignore_errors=True)
+            version = marker.read().get("version", 0)
+            for source in _index_files(self.live_path.resolve()):
+                relative = source.relative_to(self.live_path.resolve())
+                _copy_file(source, staging / "data" / relative)
+            if marker.read().get("version", 0) == version:
+                break
+            logger.warning("Index changed while copying; retrying snapshot")
+        else:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise SnapshotError("Index kept changing during the snapshot; pause ingestion and retry")
+
+        files = {}
+        for path in _index_files(staging / "data"):
+            files[str(path.relative_to(staging / "data"))] = {"size": path.stat().st_size, "sha256": file_sha256(path)}
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "name": name,
+            "created_at": time.time(),
+            "index_version": version,
+            **self._embedding_config(),
+            "files": files
+        }
+        (staging / MANIFEST).write_text(json.dumps(manifest, indent=2))
+        # Publish the snapshot in one rename so a partial copy is never listed
+        staging.replace(target)
+        logger.info(f"Created snapshot {name} with {len(files)} files")
+        return manifest
+
+    def list(self) -> List[Dict[str, Any]]:
+        snapshots = []
+        if self.snapshot_dir.exists():
+            for path in sorted(self.snapshot_dir.iterdir()):
+                if (path / MANIFEST).exists():
+                    manifest = json.loads((path / MANIFEST).read_text())
+                    snapshots.append({key: value for key, value in manifest.items() if key != "files"})
+        return snapshots
+
+    def verify(self, name: str) -> Dict[str, Any]:
+        """Check format, compatibility and every file's size and checksum."""
+        path = self.snapshot_dir / name
+        try:
+            manifest = json.loads((path / MANIFEST).read_text())
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            raise SnapshotError(f"Snapshot {name} has no readable manifest: {e}")
+
+        if manifest.get("format") != SNAPSHOT_FORMAT or manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotError(
+                f"Snapshot {name} has unsupported format {manifest.get('format')} v{manifest.get('format_version')}"
+            )
+        for key, value in self._embedding_config().items():
+            if manifest.get(key) != value:
+                raise SnapshotError(f"Snapshot {name} was built with {key}={manifest.get(key)!r}, this deployment uses {value!r}")
+        for relative, expected in manifest["files"].items():
+            file_path = path / "data" / relative
+            if not file_path.is_file() or file_path.stat().st_size != expected["size"]:
+                raise SnapshotError(f"Snapshot {name} is missing or truncated: {relative}")
+            if file_sha256(file_path) != expected["sha256"]:
+                raise SnapshotError(f"Snapshot {name} failed checksum: {relative}")
+        return manifest
+
+    def versions(self) -> List[str]:
+        """Version directories in the order they were made live, oldest first."""
+        history = self.versions_dir / "history.json"
+        try:
+            return json.loads(history.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _save_versions(self, names: List[str]):
+        tmp = self.versions_dir / f"history.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(names))
+        tmp.replace(self.versions_dir / "history.json")
+
+    def current_version(self) -> Optional[str]:
+        if self.live_path.is_symlink():
+            return Path(os.readlink(self.live_path)).name
+        return None
+
+    def _new_version_dir(self, label: str) -> Path:
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+        existing = [int(path.name.split("-", 1)[0]) for path in self.versions_dir.iterdir()
+                    if path.is_dir() and path.name.split("-", 1)[0].isdigit()]
+        return self.versions_dir / f"{max(existing, default=0) + 1:04d}-{label}"
+
+    def _adopt_live_directory(self):
+        """Move a plain live directory under versions/ so it can be swapped atomically from now on."""
+        if self.live_path.is_symlink() or not self.live_path.exists():
+            return
+        adopted = self._new_version_dir("initial")
+        self.live_path.rename(adopted)
+        self._point_live_path(adopted)
+        self._save_versions([adopted.name])
+        logger.info(f"Moved live index to {adopted}")
+
+    def _point_live_path(self, target: Path):
+        """Atomically repoint the live symlink at a version directory."""
+        link = self.live_path.parent / f".{self.live_path.name}.link.tmp"
+        if link.is_symlink() or link.exists():
+            link.unlink()
+        link.symlink_to(os.path.relpath(target, self.live_path.parent), target_is_directory=True)
+        os.replace(link, self.live_path)
+
+    def _swap_to(self, target: Path, **info) -> int:
+        """Publish a newer index version inside ``target``, then make it live."""
+        version = IndexVersion(str(self.live_path)).read().get("version", 0) + 1
+        (target / "index_version.json").write_text(
+            json.dumps({"version": version, "updated_at": time.time(), **info})
+        )
+        self._point_live_path(target)
+        return version
+
+    def restore(self, name: str) -> Dict[str, Any]:
+        """Verify a snapshot, copy it into a new version directory and swap it in."""
+        started = time.perf_counter()
+        manifest = self.verify(name)
+        self._adopt_live_directory()
+        previous = self.current_version()
+
+        target = self._new_version_dir(name)
+        staging = self.versions_dir / f".{target.name}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.copytree(self.snapshot_dir / name / "data", staging)
+        staging.rename(target)
+
+        version = self._swap_to(target, restored_from=name)
+        self._save_versions(self.versions() + [target.name])
+        self._prune()
+        logger.info(f"Restored snapshot {name} as index version {version} (previous: {previous})")
+        return {
+            "snapshot": name,
+            "version_dir": target.name,
+            "previous_version_dir": previous,
+            "index_version": version,
+            "files": len(manifest["files"]),
+            "elapsed_s": round(time.perf_counter() - started, 3)
+        }
+
+    def rollback(self) -> Dict[str, Any]:
+        """Make the previously live version directory live again."""
+        versions = self.versions()
+        current = self.current_version()
+        if len(versions) < 2 or versions[-1] != current:
+            raise SnapshotError("No earlier index version to roll back to")
+        target = self.versions_dir / versions[-2]
+        version = self._swap_to(target, rolled_back_from=current)
+        self._save_versions(versions[:-1])
+        logger.info(f"Rolled back from {current} to {target.name} as index version {version}")
+        return {"version_dir": target.name, "previous_version_dir": current, "index_version": version}
+
+    def _prune(self):
+        """Keep the live version plus the ``keep_versions`` most recent earlier ones for rollback."""
+        versions = self.versions()
+        keep = versions[-(self.keep_versions + 1):]
+        for name in versions[:len(versions) - len(keep)]:
+            shutil.rmtree(self.versions_dir / name, ignore_errors=True)
+        self._save_versions(keep)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    create = subparsers.add_parser("create", help="Snapshot the live index")
+    create.add_argument("--name")
+    subparsers.add_parser("list", help="List snapshots")
+    for command in ("verify", "restore"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("name")
+    subparsers.add_parser("rollback", help="Return to the previous index version")
+    args = parser.parse_args()
+
+    manager = SnapshotManager()
+    if args.command == "create":
+        result = manager.create(args.name)
+        result = {key: value for key, value in result.items() if key != "files"}
+    elif args.command == "list":
+        result = manager.list()
+    elif args.command == "verify":
+        result = {"name": args.name, "files": len(manager.verify(args.name)["files"]), "ok": True}
+    elif args.command == "restore":
+        result = manager.restore(args.name)
+    else:
+        result = manager.rollback()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
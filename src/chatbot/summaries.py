@@ -0,0 +1,189 @@
+import logging
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from langchain.schema import Document
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD_PATTERN = re.compile(r"[a-z][a-z'-]+")
+# Id of a stored summary entry, as cited in search observations
+SUMMARY_REFERENCE = re.compile(r"\b\d+:(?:document|section:\d+)\b")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can for from has have if in into is it its may not of on or "
+    "such that the their then there these they this to was were which will with".split()
+)
+
+
+def extractive_summary(text: str, max_sentences: int = 3) -> str:
+    """Pick the sentences that best cover the text's most frequent content words, in document order."""
+    # Overlapping chunks repeat sentences; keep the first occurrence
+    sentences = list(dict.fromkeys(s.strip() for s in SENTENCE_SPLIT.split(text) if s.strip()))
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences)
+
+    words = [[w for w in WORD_PATTERN.findall(s.lower()) if w not in STOPWORDS] for s in sentences]
+    frequency = Counter(w for sentence_words in words for w in set(sentence_words))
+    top = max(frequency.values(), default=1)
+    scores = [
+        # Headings and fragments carry little content on their own
+        sum(frequency[w] for w in set(sentence_words)) / top / len(sentence_words) ** 0.5
+        if len(sentence_words) >= 3 else 0.0
+        for sentence_words in words
+    ]
+    chosen = sorted(sorted(range(len(sentences)), key=lambda i: -scores[i])[:max_sentences])
+    return " ".join(sentences[i] for i in chosen)
+
+
+def llm_summarizer() -> Callable[[str], str]:
+    """Summarize with the chat model; costs one LLM call per section and document at ingest time."""
+    from langchain.chat_models import ChatOpenAI
+    from langchain.schema import HumanMessage
+    from config.settings import settings
+    from .deadline import timed_llm_call
+
+    llm = ChatOpenAI(openai_api_key=settings.openai_api_key, temperature=0, model_name="gpt-3.5-turbo")
+
+    def summarize(text: str) -> str:
+        prompt = f"Summarize the following content in at most three sentences:\n\n{text}\n\nSummary:"
+        return timed_llm_call(llm, [HumanMessage(content=prompt)]).content.strip()
+
+    return summarize
+
+
+class SummaryIndex:
+    """Ingest-time summaries of documents and their sections, embedded in their own collection.
+
+    Entries live in a second Chroma collection next to the chunks, so they
+    are persisted, snapshotted and reloaded together with the index. A
+    document whose chunks span several ``section`` headings gets one entry
+    per section plus a document entry built from the section summaries;
+    otherwise only the document entry is stored. ``candidate_documents``
+    ranks documents by their best-matching entry for coarse-to-fine search,
+    and ``references`` names the entries covering retrieved chunks so they
+    can be looked up by id later.
+    """
+
+    COLLECTION = "document_summaries"
+
+    def __init__(self, collection, embeddings, summarizer: Optional[Callable[[str], str]] = None,
+                 max_sentences: int = 3):
+        self.collection = collection
+        self.embeddings = embeddings
+        self.summarize = summarizer or (lambda text: extractive_summary(text, max_sentences))
+        self._document_count: Optional[int] = None
+
+    def build_entries(self, documents: Iterable[Document]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(id, summary, metadata) entries for the chunks of each document in ``documents``."""
+        by_doc: Dict[int, List[Document]] = {}
+        for doc in documents:
+            if doc.metadata.get("doc_id") is not None:
+                by_doc.setdefault(doc.metadata["doc_id"], []).append(doc)
+
+        entries = []
+        for doc_id, chunks in by_doc.items():
+            chunks.sort(key=lambda doc: doc.metadata.get("chunk_id", 0))
+            sections: List[Tuple[str, List[Document]]] = []
+            for chunk in chunks:
+                title = chunk.metadata.get("section", "")
+                if sections and sections[-1][0] == title:
+                    sections[-1][1].append(chunk)
+                else:
+                    sections.append((title, [chunk]))
+
+            if len(sections) > 1:
+                section_summaries = []
+                for number, (title, members) in enumerate(sections):
+                    summary = self.summarize("\n".join(member.page_content for member in members))
+                    summary = f"{title}: {summary}" if title else summary
+                    section_summaries.append(summary)
+                    entries.append((f"{doc_id}:section:{number}", summary, {
+                        "doc_id": doc_id,
+                        "level": "section",
+                        "section": title,
+                        "chunk_start": members[0].metadata.get("chunk_id", 0),
+                        "chunk_end": members[-1].metadata.get("chunk_id", 0)
+                    }))
+                document_summary = self.summarize("\n".join(section_summaries))
+            else:
+                document_summary = self.summarize("\n".join(chunk.page_content for chunk in chunks))
+            entries.append((f"{doc_id}:document", document_summary, {
+                "doc_id": doc_id, "level": "document", "sections": len(sections)
+            }))
+        return entries
+
+    def add_documents(self, documents: Iterable[Document]) -> int:
+        """Summarize and embed the documents the chunks belong to, replacing earlier entries."""
+        entries = [entry for entry in self.build_entries(documents) if entry[1].strip()]
+        if not entries:
+            return 0
+        doc_ids = sorted({metadata["doc_id"] for _, _, metadata in entries})
+        self.collection.delete(where={"doc_id": {"$in": doc_ids}})
+        self.collection.upsert(
+            ids=[id_ for id_, _, _ in entries],
+            embeddings=self.embeddings.embed_documents([summary for _, summary, _ in entries]),
+            documents=[summary for _, summary, _ in entries],
+            metadatas=[metadata for _, _, metadata in entries]
+        )
+        self._document_count = None
+        logger.info(f"Stored {len(entries)} summaries for {len(doc_ids)} documents")
+        return len(entries)
+
+    def backfill(self, chunks: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Summarize an index built before summaries existed, from its stored (text, metadata) chunks."""
+        return self.add_documents(Document(page_content=text, metadata=metadata) for text, metadata in chunks)
+
+    def delete_document(self, doc_id: int):
+        self.collection.delete(where={"doc_id": doc_id})
+        self._document_count = None
+
+    def document_count(self) -> int:
+        if self._document_count is None:
+            self._document_count = len(self.collection.get(where={"level": "document"}, include=[])["ids"])
+        return self._document_count
+
+    def candidate_documents(self, query_vectors: List[List[float]], n_documents: int) -> List[List[int]]:
+        """Per query, the ``n_documents`` documents whose document or section summary matches best."""
+        if not query_vectors or self.collection.count() == 0:
+            return [[] for _ in query_vectors]
+        response = self.collection.query(
+            query_embeddings=query_vectors,
+            n_results=min(self.collection.count(), n_documents * 4),
+            include=["metadatas"]
+        )
+        candidates = []
+        for metadatas in response["metadatas"]:
+            # Results come ordered by distance, so the first hit of a document is its best
+            doc_ids = list(dict.fromkeys(metadata["doc_id"] for metadata in metadatas))
+            candidates.append(doc_ids[:n_documents])
+        return candidates
+
+    def get(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        """The stored entry with this id (``"<doc_id>:document"`` or ``"<doc_id>:section:<n>"``)."""
+        records = self.collection.get(ids=[entry_id], include=["documents", "metadatas"])
+        if not records["ids"]:
+            return None
+        return {"id": entry_id, "summary": records["documents"][0], **records["metadatas"][0]}
+
+    def references(self, chunks: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Entries (id and metadata) summarizing the given chunks: their section, or their document."""
+        chunks = [metadata for metadata in chunks if metadata.get("doc_id") is not None]
+        if not chunks:
+            return []
+        doc_ids = sorted({metadata["doc_id"] for metadata in chunks})
+        records = self.collection.get(where={"doc_id": {"$in": doc_ids}}, include=["metadatas"])
+        entries = {entry_id: {"id": entry_id, **metadata}
+                   for entry_id, metadata in zip(records["ids"], records["metadatas"])}
+
+        references = {}
+        for metadata in chunks:
+            chunk_id = metadata.get("chunk_id", -1)
+            entry = next((entry for entry in entries.values()
+                          if entry["doc_id"] == metadata["doc_id"] and entry["level"] == "section"
+                          and entry["chunk_start"] <= chunk_id <= entry["chunk_end"]),
+                         entries.get(f"{metadata['doc_id']}:document"))
+            if entry is not None:
+                references.setdefault(entry["id"], entry)
+        return list(references.values())
@@ -1,22 +1,61 @@
 import logging
-from typing import List, Dict, Any, Optional
+import uuid
+import zlib
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
 import chromadb
 from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
 from config.settings import settings
+from .embeddings import create_embeddings
+from .compressed_index import CompressedVectorIndex
+from .document_registry import DocumentRecord, get_document_registry
+from .summaries import SUMMARY_REFERENCE, SummaryIndex, llm_summarizer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class SearchResult:
+    """A search hit referencing the stored chunk instead of copying it."""
+    __slots__ = ("content", "metadata", "relevance_score", "document")
+    
+    def __init__(self, content: str, metadata: Dict[str, Any], relevance_score: float,
+                 document: Optional[DocumentRecord]):
+        self.content = content
+        self.metadata = metadata
+        self.relevance_score = relevance_score
+        self.document = document
+    
+    @property
+    def source(self) -> Optional[str]:
+        return self.document.source if self.document else None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Expanded form for API responses."""
+        return {
+            "content": self.content,
+            "metadata": {**self.metadata, **(self.document.to_dict() if self.document else {})},
+            "relevance_score": self.relevance_score
+        }
+
 class VectorStore:
-    def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
+    # Compressed mode keeps chunk texts and metadata here; their vectors live in the compressed index only
+    CHUNK_COLLECTION = "document_chunks"
+    
+    def __init__(self, embedding_backend: Optional[str] = None):
+        self.embeddings = create_embeddings(embedding_backend)
         self.persist_directory = settings.chroma_db_path
+        self.registry = get_document_registry()
         self.vectorstore = None
+        self.compressed_index: Optional[CompressedVectorIndex] = None
+        self._chunks = None
+        self.summary_index: Optional[SummaryIndex] = None
+        self._summarizer = None
         self._initialize_vectorstore()
+        if settings.vector_compression != "none":
+            self._initialize_compressed_index()
+        if settings.summary_index:
+            self._initialize_summary_index()
     
     def _initialize_vectorstore(self):
         """Initialize or load existing vector store."""
@@ -30,8 +69,177 @@ class VectorStore:
             logger.error(f"Error initializing vector store: {e}")
             raise
     
-    def add_documents(self, documents: List[Document]) -> List[str]:
-        """Add documents to the vector store."""
+    def reload(self):
+        """Reopen the persisted index to pick up writes made by another process."""
+        from chromadb.api.client import SharedSystemClient
+        # Chroma caches one system per path; drop it so the new client re-reads from disk
+        SharedSystemClient.clear_system_cache()
+        self._initialize_vectorstore()
+        # Reconnect rather than re-query: a restore may have swapped the files underneath
+        self.registry.reopen()
+        if self.compressed_index is not None:
+            self._initialize_compressed_index()
+        if self.summary_index is not None:
+            self._initialize_summary_index()
+        logger.info("Vector store reloaded from disk")
+    
+    @property
+    def collection(self):
+        """The Chroma collection holding the chunks."""
+        return self._chunks if self._chunks is not None else self.vectorstore._collection
+    
+    @staticmethod
+    def _placeholder_embeddings(ids: List[str]) -> List[List[float]]:
+        # Chroma requires a vector per record; a distinct 1-dim value keeps its HNSW graph trivial
+        return [[zlib.crc32(id_.encode()) / 2 ** 32] for id_ in ids]
+    
+    def _initialize_compressed_index(self):
+        """Open the compressed index and the chunk collection, migrating chunks stored with full vectors."""
+        compressed_index = CompressedVectorIndex(
+            str(Path(self.persist_directory) / f"compressed_{settings.vector_compression}"),
+            mode=settings.vector_compression,
+            memory_budget_mb=settings.compressed_memory_budget_mb,
+            rescore_factor=settings.compressed_rescore_factor
+        )
+        client = self.vectorstore._client
+        legacy = self.vectorstore._collection
+        if settings.api_role == "reader":
+            try:
+                chunks = client.get_collection(self.CHUNK_COLLECTION, embedding_function=None)
+            except Exception:
+                # The writer has not migrated this index yet
+                chunks = None
+            # Swap in one assignment each so concurrent searches never see a half-loaded index
+            self.compressed_index, self._chunks = compressed_index, chunks
+            return
+        
+        chunks = client.get_or_create_collection(self.CHUNK_COLLECTION, embedding_function=None)
+        self.compressed_index, self._chunks = compressed_index, chunks
+        batch_size = 5000
+        migrated = 0
+        while legacy.count() > 0:
+            # Deleting each batch once copied lets an interrupted migration resume
+            records = legacy.get(include=["embeddings", "documents", "metadatas"], limit=batch_size)
+            chunks.upsert(ids=records["ids"], embeddings=self._placeholder_embeddings(records["ids"]),
+                          documents=records["documents"], metadatas=records["metadatas"])
+            compressed_index.add(records["ids"], records["embeddings"])
+            legacy.delete(ids=records["ids"])
+            migrated += len(records["ids"])
+        if migrated:
+            logger.info(f"Moved {migrated} chunks out of the full-precision Chroma index")
+        if compressed_index.count == 0 and chunks.count() > 0:
+            # The compressed files were lost; the chunk collection has no vectors, so re-embed
+            for offset in range(0, chunks.count(), batch_size):
+                records = chunks.get(include=["documents"], limit=batch_size, offset=offset)
+                compressed_index.add(records["ids"], self.embeddings.embed_documents(records["documents"]))
+            logger.info(f"Rebuilt compressed index with {compressed_index.count} vectors")
+    
+    def _initialize_summary_index(self):
+        """Open the summary collection, backfilling it from the stored chunks if it is empty."""
+        if self._summarizer is None and settings.summary_method == "llm":
+            self._summarizer = llm_summarizer()
+        collection = self.vectorstore._client.get_or_create_collection(
+            SummaryIndex.COLLECTION, embedding_function=None
+        )
+        self.summary_index = SummaryIndex(collection, self.embeddings, self._summarizer,
+                                          max_sentences=settings.summary_max_sentences)
+        read_only = settings.api_role == "reader"
+        if not read_only and collection.count() == 0 and self.collection.count() > 0:
+            self.summary_index.backfill(self.iter_chunks())
+    
+    def _hierarchical(self) -> bool:
+        """Whether the corpus is large enough for coarse-to-fine search to pay off."""
+        return (self.summary_index is not None
+                and self.summary_index.document_count() >= settings.hierarchical_min_documents)
+    
+    def _hierarchical_search(self, vectors: List[List[float]], k: int) -> List[List[tuple]]:
+        """Pick candidate documents from the summary index, then search only their chunks."""
+        candidates = self.summary_index.candidate_documents(vectors, settings.hierarchical_candidate_documents)
+        collection = self.collection
+        scored = []
+        for vector, doc_ids in zip(vectors, candidates):
+            if not doc_ids:
+                scored.append([])
+                continue
+            where = {"doc_id": {"$in": doc_ids}}
+            if self.compressed_index is not None:
+                ids = collection.get(where=where, include=[])["ids"]
+                hits = self.compressed_index.search_subset(vector, ids, k=k)
+                scored.append(self._to_distance_hits(hits, self._fetch_documents([id_ for id_, _ in hits])))
+            else:
+                response = collection.query(query_embeddings=[vector], n_results=k, where=where,
+                                            include=["documents", "metadatas", "distances"])
+                scored.append([
+                    (Document(page_content=text, metadata=metadata or {}), distance)
+                    for text, metadata, distance in zip(
+                        response["documents"][0], response["metadatas"][0], response["distances"][0]
+                    )
+                ])
+        return scored
+    
+    def find_summary(self, text: str) -> Optional[Dict[str, Any]]:
+        """The stored summary ``text`` cites by id, e.g. "3:section:1" from a search observation."""
+        if self.summary_index is None:
+            return None
+        reference = SUMMARY_REFERENCE.search(text)
+        if reference is None:
+            return None
+        try:
+            return self.summary_index.get(reference.group(0))
+        except Exception as e:
+            logger.error(f"Error looking up stored summary: {e}")
+            return None
+    
+    def summary_references(self, results: List[SearchResult]) -> List[Dict[str, Any]]:
+        """The stored summary entries of the sections (or documents) the results come from."""
+        if self.summary_index is None:
+            return []
+        try:
+            return self.summary_index.references(result.metadata for result in results)
+        except Exception as e:
+            logger.error(f"Error looking up summary references: {e}")
+            return []
+    
+    def _add_to_compressed_store(self, documents: List[Document]) -> List[str]:
+        """Embed once, store documents in Chroma and vectors in the compressed index only."""
+        ids = [str(uuid.uuid4()) for _ in documents]
+        texts = [doc.page_content for doc in documents]
+        vectors = self.embeddings.embed_documents(texts)
+        self.collection.upsert(
+            ids=ids,
+            embeddings=self._placeholder_embeddings(ids),
+            documents=texts,
+            metadatas=[doc.metadata for doc in documents]
+        )
+        self.compressed_index.add(ids, vectors)
+        return ids
+    
+    def _fetch_documents(self, ids: List[str]) -> Dict[str, Document]:
+        """Fetch stored chunks from Chroma by id."""
+        records = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            id_: Document(page_content=text, metadata=metadata or {})
+            for id_, text, metadata in zip(records["ids"], records["documents"], records["metadatas"])
+        }
+    
+    @staticmethod
+    def _to_distance_hits(hits: List[tuple], by_id: Dict[str, Document]) -> List[tuple]:
+        # Report squared L2 distance like Chroma's default space (vectors are normalized)
+        return [(by_id[id_], 2.0 - 2.0 * score) for id_, score in hits if id_ in by_id]
+    
+    def _compressed_search(self, query: str, k: int) -> List[tuple]:
+        """Search the compressed index and fetch the matching documents from Chroma."""
+        hits = self.compressed_index.search(self.embeddings.embed_query(query), k=k)
+        if not hits:
+            return []
+        return self._to_distance_hits(hits, self._fetch_documents([id_ for id_, _ in hits]))
+    
+    def add_documents(self, documents: List[Document], batch_size: int = 64,
+                      progress: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """Add documents to the vector store, embedding them in batches.
+        
+        ``progress`` is called with (documents added, total) after each batch.
+        """
         if not documents:
             logger.warning("No documents to add")
             return []
@@ -44,22 +252,72 @@ class VectorStore:
                 logger.warning("No valid documents to add")
                 return []
             
-            ids = self.vectorstore.add_documents(valid_documents)
+            ids = []
+            for start in range(0, len(valid_documents), batch_size):
+                batch = valid_documents[start:start + batch_size]
+                if self.compressed_index is not None:
+                    ids.extend(self._add_to_compressed_store(batch))
+                else:
+                    ids.extend(self.vectorstore.add_documents(batch))
+                if progress is not None:
+                    progress(len(ids), len(valid_documents))
             self.vectorstore.persist()
+            if self.summary_index is not None:
+                self.summary_index.add_documents(valid_documents)
             logger.info(f"Added {len(valid_documents)} documents to vector store")
             return ids
         except Exception as e:
             logger.error(f"Error adding documents to vector store: {e}")
             return []
     
+    def iter_chunks(self, batch_size: int = 1000) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (text, metadata) for every stored chunk, reading the collection in pages."""
+        collection = self.collection
+        for offset in range(0, collection.count(), batch_size):
+            records = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            for text, metadata in zip(records["documents"], records["metadatas"]):
+                yield text, metadata or {}
+    
+    def delete_source(self, source: str) -> int:
+        """Delete every chunk of a document and forget its record; returns the chunks removed."""
+        try:
+            if self.vectorstore is None:
+                logger.error("Vector store not initialized")
+                return 0
+            
+            record = self.registry.get_by_source(source)
+            collection = self.collection
+            # Legacy chunks carry the source path instead of a doc_id
+            where = {"doc_id": record.doc_id} if record is not None else {"source": source}
+            ids = collection.get(where=where, include=[])["ids"]
+            if ids:
+                collection.delete(ids=ids)
+                if self.compressed_index is not None:
+                    self.compressed_index.delete(ids)
+                self.vectorstore.persist()
+            if record is not None:
+                if self.summary_index is not None:
+                    self.summary_index.delete_document(record.doc_id)
+                self.registry.remove(source)
+            logger.info(f"Deleted {len(ids)} chunks of {source}")
+            return len(ids)
+        except Exception as e:
+            logger.error(f"Error deleting chunks of {source}: {e}")
+            return 0
+    
     def similarity_search(self, query: str, k: int = 5) -> List[Document]:
         """Search for similar documents."""
         try:
-            if not self.vectorstore:
+            if self.vectorstore is None:
                 logger.error("Vector store not initialized")
                 return []
             
-            results = self.vectorstore.similarity_search(query, k=k)
+            if self._hierarchical():
+                results = [doc for doc, _ in self._hierarchical_search([self.embeddings.embed_query(query)], k)[0]]
+            elif self.compressed_index is not None:
+                results = [doc for doc, _ in self._compressed_search(query, k)]
+            else:
+                results = self.vectorstore.similarity_search(query, k=k)
             logger.info(f"Found {len(results)} similar documents")
             return results
         except Exception as e:
@@ -69,29 +327,94 @@ class VectorStore:
     def similarity_search_with_score(self, query: str, k: int = 5) -> List[tuple]:
         """Search for similar documents with similarity scores."""
         try:
-            if not self.vectorstore:
+            if self.vectorstore is None:
                 logger.error("Vector store not initialized")
                 return []
             
-            results = self.vectorstore.similarity_search_with_score(query, k=k)
+            if self._hierarchical():
+                results = self._hierarchical_search([self.embeddings.embed_query(query)], k)[0]
+            elif self.compressed_index is not None:
+                results = self._compressed_search(query, k)
+            else:
+                results = self.vectorstore.similarity_search_with_score(query, k=k)
             logger.info(f"Found {len(results)} similar documents with scores")
             return results
         except Exception as e:
             logger.error(f"Error during similarity search with score: {e}")
             return []
     
+    def search(self, query: str, k: int = 5) -> List[SearchResult]:
+        """Search and resolve each hit's shared document record."""
+        return [
+            SearchResult(doc.page_content, doc.metadata, float(score), self.registry.resolve(doc.metadata))
+            for doc, score in self.similarity_search_with_score(query, k=k)
+        ]
+    
+    def search_batch(self, queries: List[str], k: int = 5,
+                     vectors: Optional[List[List[float]]] = None) -> List[List[SearchResult]]:
+        """Search many queries at once: one batched embedding pass and one vectorized index lookup.
+        
+        Pass ``vectors`` when the queries have already been embedded.
+        """
+        if not queries:
+            return []
+        try:
+            if self.vectorstore is None:
+                logger.error("Vector store not initialized")
+                return [[] for _ in queries]
+            
+            if vectors is None:
+                vectors = self.embeddings.embed_documents(queries)
+            if self._hierarchical():
+                scored = self._hierarchical_search(vectors, k)
+            elif self.compressed_index is not None:
+                hits_per_query = self.compressed_index.search_batch(vectors, k=k)
+                by_id = self._fetch_documents(list({id_ for hits in hits_per_query for id_, _ in hits}))
+                scored = [self._to_distance_hits(hits, by_id) for hits in hits_per_query]
+            else:
+                response = self.vectorstore._collection.query(
+                    query_embeddings=vectors, n_results=k,
+                    include=["documents", "metadatas", "distances"]
+                )
+                scored = [
+                    [(Document(page_content=text, metadata=metadata or {}), distance)
+                     for text, metadata, distance in zip(texts, metadatas, distances)]
+                    for texts, metadatas, distances in zip(
+                        response["documents"], response["metadatas"], response["distances"]
+                    )
+                ]
+            logger.info(f"Batch search for {len(queries)} queries")
+            return [
+                [SearchResult(doc.page_content, doc.metadata, float(score), self.registry.resolve(doc.metadata))
+                 for doc, score in hits]
+                for hits in scored
+            ]
+        except Exception as e:
+            logger.error(f"Error during batch search: {e}")
+            return [[] for _ in queries]
+    
     def get_collection_info(self) -> Dict[str, Any]:
         """Get information about the collection."""
         try:
-            if not self.vectorstore:
+            if self.vectorstore is None:
                 return {"error": "Vector store not initialized"}
             
-            collection = self.vectorstore._collection
+            collection = self.collection
             count = collection.count()
-            return {
+            info = {
                 "document_count": count,
-                "collection_name": collection.name
+                "collection_name": collection.name,
+                "source_documents": len(self.registry)
             }
+            if self.compressed_index is not None:
+                info["compression"] = self.compressed_index.memory_usage()
+            if self.summary_index is not None:
+                info["summaries"] = {
+                    "documents": self.summary_index.document_count(),
+                    "entries": self.summary_index.collection.count(),
+                    "hierarchical_search": self._hierarchical()
+                }
+            return info
         except Exception as e:
             logger.error(f"Error getting collection info: {e}")
             return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,270 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.txt'}
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def fingerprint(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, or None when it no longer exists."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def snapshot_directory(directory: str, extensions: Iterable[str] = SUPPORTED_EXTENSIONS) -> Dict[str, Tuple[int, int]]:
+    """Fingerprints of all supported files below a directory, keyed like ``process_directory`` paths."""
+    snapshot = {}
+    extensions = set(extensions)
+    for path in Path(directory).rglob('*'):
+        if path.suffix.lower() in extensions and path.is_file():
+            current = fingerprint(str(path))
+            if current is not None:
+                snapshot[str(path)] = current
+    return snapshot
+
+
+class _Inotify:
+    """Minimal recursive inotify reader over libc, without third-party packages."""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, Path] = {}
+        for path in [Path(directory), *(p for p in Path(directory).rglob('*') if p.is_dir())]:
+            self.add_watch(path)
+
+    def add_watch(self, path: Path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self._dirs[wd] = path
+
+    def read(self, timeout: float) -> Tuple[Set[str], bool]:
+        """Changed paths within ``timeout`` seconds, and whether events were lost (rescan needed)."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set(), False
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set(), False
+
+        paths, overflow, offset = set(), False, 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in the new directory before it is watched
+                    self.add_watch(path)
+                    overflow = True
+                continue
+            paths.add(str(path))
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Watch a directory tree and hand debounced batches of changed files to a callback.
+
+    Uses inotify on Linux and falls back to polling (comparing mtime and size
+    snapshots every ``poll_interval`` seconds). A batch is flushed once no new
+    event has arrived for ``debounce_seconds``, or ``max_delay_seconds`` after
+    its first event so a steady stream of writes to other files cannot starve
+    ingestion. Either way a file is only handed over once its size and mtime
+    have stayed the same for ``settle_seconds`` (two stats that far apart), so
+    a file that is still being written waits. The callback runs on the
+    watcher thread and receives the changed paths; it decides from the file
+    system whether each one was created, modified or deleted.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        on_changes: Callable[[List[str]], None],
+        debounce_seconds: float = 2.0,
+        max_delay_seconds: float = 30.0,
+        poll_interval: float = 5.0,
+        use_inotify: bool = True,
+        extensions: Iterable[str] = SUPPORTED_EXTENSIONS,
+        settle_seconds: Optional[float] = None
+    ):
+        self.directory = directory
+        self.on_changes = on_changes
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.poll_interval = poll_interval
+        self.settle_seconds = debounce_seconds if settle_seconds is None else settle_seconds
+        self.extensions = set(extensions)
+        self._inotify: Optional[_Inotify] = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify(directory)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable, falling back to polling: {e}")
+        self.mode = "inotify" if self._inotify is not None else "polling"
+
+        self._pending: Dict[str, float] = {}
+        # Last seen fingerprint of each pending file and when it was first seen
+        self._observed: Dict[str, Tuple[Optional[Tuple[int, int]], float]] = {}
+        self._pending_lock = threading.Lock()
+        self._last_event = 0.0
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._processing = 0
+        self._metrics = {
+            "events": 0,
+            "batches": 0,
+            "files_synced": 0,
+            "errors": 0,
+            "last_lag_s": 0.0,
+            "max_lag_s": 0.0
+        }
+
+    def start(self):
+        self._snapshot = snapshot_directory(self.directory, self.extensions)
+        self._thread = threading.Thread(target=self._run, name="upload-dir-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.directory} for changes ({self.mode})")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def _record(self, paths: Iterable[str]):
+        now = time.monotonic()
+        with self._pending_lock:
+            for path in paths:
+                if Path(path).suffix.lower() in self.extensions:
+                    self._pending.setdefault(path, now)
+                    self._settled(path, now)
+                    self._last_event = now
+                    self._metrics["events"] += 1
+
+    def _settled(self, path: str, now: float) -> bool:
+        """Whether the file's fingerprint has not changed for ``settle_seconds``."""
+        current = fingerprint(path)
+        observed = self._observed.get(path)
+        if observed is None or observed[0] != current:
+            self._observed[path] = (current, now)
+            return False
+        return now - observed[1] >= self.settle_seconds
+
+    def _poll(self) -> Set[str]:
+        """Paths whose fingerprint changed since the previous snapshot."""
+        snapshot = snapshot_directory(self.directory, self.extensions)
+        changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(path) != self._snapshot.get(path)}
+        self._snapshot = snapshot
+        return changed
+
+    def _due(self) -> bool:
+        with self._pending_lock:
+            if not self._pending:
+                return False
+            oldest = min(self._pending.values())
+        now = time.monotonic()
+        return now - self._last_event >= self.debounce_seconds or now - oldest >= self.max_delay_seconds
+
+    def _flush(self):
+        now = time.monotonic()
+        with self._pending_lock:
+            batch = {path: first for path, first in self._pending.items() if self._settled(path, now)}
+            if not batch:
+                return
+            for path in batch:
+                del self._pending[path]
+                del self._observed[path]
+            self._processing = len(batch)
+        oldest = min(batch.values())
+        try:
+            self.on_changes(sorted(batch))
+            self._metrics["files_synced"] += len(batch)
+        except Exception as e:
+            self._metrics["errors"] += 1
+            logger.error(f"Error syncing changed files: {e}")
+        finally:
+            self._processing = 0
+        lag = time.monotonic() - oldest
+        self._metrics["batches"] += 1
+        self._metrics["last_lag_s"] = round(lag, 3)
+        self._metrics["max_lag_s"] = round(max(self._metrics["max_lag_s"], lag), 3)
+
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_interval
+        while not self._stop.is_set():
+            try:
+                if self._inotify is not None:
+                    paths, overflow = self._inotify.read(timeout=min(self.debounce_seconds, 1.0))
+                    if overflow:
+                        paths |= self._poll()
+                    self._record(paths)
+                else:
+                    wait = max(0.0, min(next_poll - time.monotonic(), self.debounce_seconds))
+                    if self._stop.wait(wait):
+                        break
+                    if time.monotonic() >= next_poll:
+                        self._record(self._poll())
+                        next_poll = time.monotonic() + self.poll_interval
+                if self._due():
+                    self._flush()
+            except Exception as e:
+                self._metrics["errors"] += 1
+                logger.error(f"Watcher error: {e}")
+                self._stop.wait(1.0)
+
+    def get_metrics(self) -> Dict[str, float]:
+        with self._pending_lock:
+            backlog = len(self._pending) + self._processing
+            oldest = min(self._pending.values()) if self._pending else None
+        return {
+            "mode": self.mode,
+            "backlog": backlog,
+            "oldest_pending_s": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            **self._metrics
+        }